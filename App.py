@@ -1,17 +1,42 @@
+import hashlib
+import os
+import secrets
+import time
+from collections import deque
 import streamlit as st
 from logic import (
     connect_spotify,
-    fetch_all_spotify_data,
     deduplicate_and_weight,
-    build_music_prompt,
-    get_personality_traits,
-    setup_conversational_chain
+    sample_reply,
+    setup_conversational_chain,
+    submit_analysis,
+    stream_chat_reply
 )
-import time
+from library_cache import fetch_cached_spotify_data
+from clients import ClientRegistry, set_registry
+from tracing import METRICS, Trace, activate, prometheus_text, span
+from session_store import SESSION_FIELDS, SESSION_TTL, get_session_store
+
+run_started = time.perf_counter()
 
 PROJECT_NAME = "AI Personality Mirror"
+# Cookie holding the secret the stored session is found by
+SESSION_COOKIE = "mirror_session"
+# Server time of the most recent page and chat-fragment reruns kept per session for the debug panel
+RERUN_TIMINGS_KEPT = 50
+# How often the Reveal screen checks whether the genre preview has landed
+PREVIEW_POLL_SECONDS = 1.0
 st.set_page_config(page_title=PROJECT_NAME, layout="wide")
 
+
+# One registry per server process, so every session reuses the same warm LLM and Spotify clients
+@st.cache_resource
+def client_registry():
+    return ClientRegistry()
+
+
+set_registry(client_registry())
+
 # --- Styling ---
 st.markdown(f"""
     <style>
@@ -181,6 +206,10 @@ st.markdown(f"""
             font-size: 1.3em;
         }}
             
+        .personality-trait-container .progress {{
+            background-color: #3CB371;
+        }}
+
         div.stSpinner {{
             text-align: center;
             align-items: center;
@@ -203,6 +232,41 @@ if "messages" not in st.session_state:
     st.session_state.messages = []
 if "show_share_modal" not in st.session_state:
     st.session_state.show_share_modal = False
+if "chat_timings" not in st.session_state:
+    st.session_state.chat_timings = []
+if "rerun_timings" not in st.session_state:
+    st.session_state.rerun_timings = deque(maxlen=RERUN_TIMINGS_KEPT)
+if "trace" not in st.session_state:
+    st.session_state.trace = Trace()
+
+# Spans of this run, and of the background analysis it submits, are kept in the session's trace
+activate(st.session_state.trace)
+
+# A random secret in a first-party cookie lets a reload, or another worker behind the load balancer,
+# pick up the finished analysis and chat from the session store. It never goes in the URL, where a
+# copied or shared link would hand the session over; the store only sees a hash of it.
+if "session_id" not in st.session_state:
+    session_secret = st.context.cookies.get(SESSION_COOKIE)
+    # Under AppTest the cookies come from a mock runtime and aren't strings
+    if not isinstance(session_secret, str) or not session_secret:
+        session_secret = secrets.token_urlsafe(32)
+        st.html(f"""<script>
+            document.cookie = "{SESSION_COOKIE}={session_secret}; Max-Age={SESSION_TTL}; Path=/; SameSite=Strict"
+                + (location.protocol === "https:" ? "; Secure" : "");
+        </script>""", unsafe_allow_javascript=True)
+    st.session_state.session_id = hashlib.sha256(session_secret.encode("utf-8")).hexdigest()[:32]
+    # Links from before the cookie carried ?sid=; they no longer restore anything
+    st.query_params.pop("sid", None)
+    restored = get_session_store().load(st.session_state.session_id)
+    if restored:
+        st.session_state.update({field: restored[field] for field in SESSION_FIELDS})
+        st.session_state.chat_memory_state = restored["memory"]
+        st.session_state.show_traits = True
+        st.session_state.chat_enabled = True
+        st.session_state.stage = "results"
+
+# Opt-in debug panel: ?debug=1 in the URL, or MIRROR_DEBUG=1 for every session
+debug_enabled = os.environ.get("MIRROR_DEBUG") == "1" or st.query_params.get("debug") == "1"
 
 
 # --- Navigation Bar ---
@@ -268,6 +332,95 @@ if st.session_state.show_share_modal:
 
 
 
+def build_trait_cards(trait_summary):
+    cards = []
+    for trait_line in trait_summary.strip().split('\n'):
+        if ": " in trait_line:
+            name, percentage_str = trait_line.split(": ", 1)
+            cards.append(f"""
+                <div class='personality-trait-container'>
+                    <span class='trait-name'>{name.strip()}</span>
+                    <div class='progress-bar'>
+                        <div class='progress' style='width: {percentage_str.strip()};'></div>
+                        <span class='trait-percentage'>{percentage_str.strip()}</span>
+                    </div>
+                </div>
+            """)
+    return cards
+
+
+def session_chat_chain():
+    # A restored session gets its chain back only once it chats again
+    if "chat_chain" not in st.session_state:
+        st.session_state.chat_chain = setup_conversational_chain(
+            st.session_state.trait_summary,
+            st.session_state.song_list,
+            st.session_state.pop("chat_memory_state", None),
+        )
+    return st.session_state.chat_chain
+
+
+def save_session():
+    state = {field: st.session_state.get(field) for field in SESSION_FIELDS}
+    chain = st.session_state.get("chat_chain")
+    state["memory"] = chain.memory.dump_state() if chain else st.session_state.get("chat_memory_state")
+    get_session_store().save(st.session_state.session_id, state)
+
+
+def record_rerun(scope, started):
+    server_time = time.perf_counter() - started
+    st.session_state.rerun_timings.append({"scope": scope, "stage": st.session_state.stage, "server_time": server_time})
+    METRICS.observe("mirror_rerun_seconds", server_time, scope=scope)
+
+
+def render_messages(messages):
+    for message in messages:
+        with st.chat_message(message["role"]):
+            st.markdown(message["content"])
+
+
+# Sending a message reruns only this fragment, not the CSS, navbar, trait cards and earlier messages
+# above it; it only draws the messages added since the last full run
+@st.fragment
+def chat_panel():
+    fragment_started = time.perf_counter()
+    activate(st.session_state.trace)
+    render_messages(st.session_state.messages[st.session_state.rendered_messages:])
+
+    if prompt := st.chat_input("Type your question here..."):
+        st.session_state.messages.append({"role": "user", "content": prompt})
+        with st.chat_message("user"):
+            st.markdown(prompt)
+
+        with st.chat_message("assistant"):
+            # Sample questions were answered while the user read their traits
+            ai_response = sample_reply(session_chat_chain(), st.session_state.get("sample_answers"), prompt)
+            if ai_response is not None:
+                st.markdown(ai_response)
+            else:
+                ai_response = st.write_stream(
+                    stream_chat_reply(session_chat_chain(), prompt, st.session_state.chat_timings)
+                )
+        st.session_state.messages.append({"role": "assistant", "content": ai_response})
+        save_session()
+    record_rerun("chat", fragment_started)
+
+
+def render_first_read(preview):
+    # Instant first read from artist genres while Gemini is still working on the full analysis
+    if preview.exception() is None and preview.result()["local_traits"]:
+        first_read = " · ".join(line.removeprefix("🎧 ") for line in preview.result()["local_traits"].split("\n")[:3])
+        st.markdown(f"<p style='text-align: center; font-size: 0.9em; color: #90caf9;'>First read from your genres: {first_read}</p>", unsafe_allow_html=True)
+
+
+# The genre preview usually lands a second or two after Connect; poll for it while the user waits.
+# Once it has landed one full run draws it, and this fragment and its timer are gone from the page.
+@st.fragment(run_every=PREVIEW_POLL_SECONDS)
+def first_read_poll(preview):
+    if preview.done():
+        st.rerun()
+
+
 # --- Page 1: The Cool Techy Entrance ---
 if st.session_state.stage == "start":
     st.markdown("<p class='techy-text'></p>", unsafe_allow_html=True)
@@ -282,22 +435,20 @@ if st.session_state.stage == "start":
         connect_button = st.button("🔗 Connect to Spotify", key="connect_button", use_container_width=True)
     if connect_button:
         try:
-            with st.spinner("Tuning into your musical universe..."):
-                sp = connect_spotify()
-                df = fetch_all_spotify_data(sp)
+            with st.spinner("Tuning into your musical universe..."), span("connect"):
+                sp = connect_spotify(st.session_state.session_id)
+                df = fetch_cached_spotify_data(sp)
                 df = deduplicate_and_weight(df)
-                prompt, song_list = build_music_prompt(df)
-                trait_summary = get_personality_traits(prompt)
-
-                st.session_state.song_list = song_list
-                st.session_state.trait_summary = trait_summary.content
-                st.session_state.chat_chain = setup_conversational_chain(trait_summary.content, song_list)
 
+                # Gemini analysis and chat setup keep running while the user is on the next screen
+                st.session_state.analysis = submit_analysis(df, sp)
                 st.session_state.data_loaded = True
                 st.session_state.stage = "show_button"
-                st.rerun()
         except Exception as e:
             st.error(f"Failed to connect the audio stream: {e}")
+        else:
+            # Outside the span, which would otherwise close on the rerun's exception
+            st.rerun()
 
 
     st.markdown("<hr class='separator'>", unsafe_allow_html=True)
@@ -321,9 +472,24 @@ elif st.session_state.stage == "show_button":
         Reveal_button = st.button("✨ Reveal My Musical Personality", key="reveal_button", use_container_width=False)
     
     if Reveal_button:
+        try:
+            with st.spinner("Decoding your sonic identity..."), span("reveal.wait"):
+                analysis = st.session_state.analysis["analysis"].result()
+        except Exception as e:
+            st.session_state.stage = "start"
+            st.error(f"Failed to decode your musical personality: {e}")
+            st.stop()
+        st.session_state.song_list = analysis["song_list"]
+        st.session_state.trait_summary = analysis["trait_summary"]
+        st.session_state.pop("trait_cards", None)
+        st.session_state.trait_source = analysis["trait_source"]
+        st.session_state.drift = analysis["drift"]
+        st.session_state.chat_chain = analysis["chat_chain"]
+        st.session_state.sample_answers = analysis["sample_answers"]
         st.session_state.show_traits = True
         st.session_state.chat_enabled = True
         st.session_state.stage = "results"
+        save_session()
         st.rerun()
     st.markdown("""
     <style>
@@ -341,52 +507,27 @@ elif st.session_state.stage == "show_button":
     </div>
     """, unsafe_allow_html=True)
 
+    preview = st.session_state.get("analysis", {}).get("preview")
+    if preview is not None and preview.done():
+        render_first_read(preview)
+    elif preview is not None:
+        first_read_poll(preview)
+
 # --- Page 3: The Unveiling and Chat ---
 elif st.session_state.stage == "results":
     #st.title(f"🔮 {PROJECT_NAME}")
     st.subheader("Your Musical Signature:")
 
     if st.session_state.show_traits:
-        traits = st.session_state.trait_summary.strip().split('\n')
+        # Trait cards are parsed and turned into HTML once per session, not on every rerun
+        if "trait_cards" not in st.session_state:
+            st.session_state.trait_cards = build_trait_cards(st.session_state.trait_summary)
+        if st.session_state.get("trait_source") == "local":
+            st.caption("Our AI is taking a breather, so this read comes straight from your genres.")
         cols = st.columns(3)
-        for i, trait_line in enumerate(traits):
-            if ": " in trait_line:
-                name, percentage_str = trait_line.split(": ")
-                col_index = i % 3
-                with cols[col_index]:
-                    st.markdown(f"""
-                        <div class='personality-trait-container'>
-                            <span class='trait-name'>{name.strip()}</span>
-                            <div class='progress-bar'>
-                                <div class='progress' style='width: {percentage_str.strip()};'></div>
-                                <span class='trait-percentage'>{percentage_str.strip()}</span>
-                            </div>
-                        </div>
-                        <style>
-                            .progress-bar {{
-                                background-color: #333;
-                                border-radius: 10px;
-                                overflow: hidden;
-                                display: flex;
-                                align-items: center;
-                                justify-content: space-between;
-                                padding: 0 0.5em;
-                            }}
-                            .progress {{
-                                background-color: #3CB371;
-                                height: 1em;
-                                border-radius: 10px;
-                                transition: width 0.5s ease;
-                            }}
-                            .trait-percentage {{
-                                color: #f0f0f0;
-                                font-size: 0.8em;
-                                min-width: 2.5em;
-                                text-align: right;
-                            }}
-                        </style>
-                    """, unsafe_allow_html=True)
-        
+        for i, card in enumerate(st.session_state.trait_cards):
+            with cols[i % 3]:
+                st.markdown(card, unsafe_allow_html=True)
 
     if st.session_state.chat_enabled:
         st.markdown("<hr class='separator'>", unsafe_allow_html=True)
@@ -397,21 +538,9 @@ elif st.session_state.stage == "results":
         st.markdown("<p style='font-size: 0.9em; color: #d0d0d0;'>🧙🏼‍♂️ What Harry Potter house would I be in?</p>", unsafe_allow_html=True)
         st.markdown("<p style='font-size: 0.9em; color: #d0d0d0;'>🚗 What car model would I be?</p>", unsafe_allow_html=True)
         st.markdown("<p style='font-size: 0.9em; color: #d0d0d0;'>Dating Promt: A life goal of mine...</p>", unsafe_allow_html=True)
-        if "messages" in st.session_state:
-            for message in st.session_state.messages:
-                with st.chat_message(message["role"]):
-                    st.markdown(message["content"])
-
-        if prompt := st.chat_input("Type your question here..."):
-            st.session_state.messages.append({"role": "user", "content": prompt})
-            with st.chat_message("user"):
-                st.markdown(prompt)
-
-            with st.spinner("Consulting the musical spirits..."):
-                ai_response = st.session_state.chat_chain.predict(input=prompt)
-                st.session_state.messages.append({"role": "assistant", "content": ai_response})
-                with st.chat_message("assistant"):
-                    st.markdown(ai_response)
+        st.session_state.rendered_messages = len(st.session_state.messages)
+        render_messages(st.session_state.messages)
+        chat_panel()
         st.markdown("</div>", unsafe_allow_html=True)
 
         # Share Modal Logic
@@ -424,4 +553,38 @@ if st.session_state.get("show_share_modal", False):
                 <button class="copy-url-button" onclick="navigator.clipboard.writeText('https://your-website-link.com')">📋 Copy</button>
             </div>
         </div>
-    """, unsafe_allow_html=True)
\ No newline at end of file
+    """, unsafe_allow_html=True)
+
+record_rerun("page", run_started)
+
+if debug_enabled:
+    with st.expander("🛠️ Debug: where the time went", expanded=False):
+        spans = st.session_state.trace.spans()
+        st.dataframe([
+            {
+                "stage": record["name"],
+                "ms": round(record["duration"] * 1000, 1),
+                "status": record["status"],
+                "thread": record["thread"],
+                "details": ", ".join(f"{key}={value}" for key, value in record["attributes"].items()),
+            }
+            for record in reversed(spans)
+        ], use_container_width=True)
+        if st.session_state.rerun_timings:
+            st.caption("Reruns (server time; a chat message only reruns the chat fragment)")
+            st.dataframe([
+                {**timing, "server_time": round(timing["server_time"] * 1000, 1)}
+                for timing in reversed(st.session_state.rerun_timings)
+            ], column_config={"server_time": "server ms"}, use_container_width=True)
+        if st.session_state.chat_timings:
+            st.caption("Chat turns")
+            st.dataframe(st.session_state.chat_timings, use_container_width=True)
+        if st.session_state.get("drift"):
+            drift = st.session_state.drift
+            score = "n/a" if drift["drift"] is None else f"{drift['drift']:.3f}"
+            st.caption(f"Profile drift {score} (threshold {drift['threshold']:.2f}): {drift['decision']}")
+        footprint = get_session_store().footprint(st.session_state.session_id)
+        st.caption(f"Session {st.session_state.session_id}: {footprint['stored_bytes']:,} bytes in the session store "
+                   f"({footprint['raw_bytes']:,} before compression)")
+        st.caption("Process metrics (Prometheus text format)")
+        st.code(prometheus_text(), language="text")
@@ -0,0 +1,77 @@
+# analysis_cache.py
+
+import threading
+import time
+from collections import OrderedDict
+
+from clients import open_sqlite
+
+# In-process tier: most recent analyses, shared by every session of the server process
+MEMORY_ENTRIES = 256
+
+# Disk tier: least recently used analyses are evicted once the stored text exceeds this size
+DISK_MAX_BYTES = 32 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS analyses_accessed_at ON analyses (accessed_at);
+"""
+
+
+class AnalysisCache:
+    """Two-tier (LRU memory + SQLite disk) cache of LLM analyses keyed by content fingerprint."""
+
+    def __init__(self, path, memory_entries=MEMORY_ENTRIES, disk_max_bytes=DISK_MAX_BYTES):
+        self.memory_entries = memory_entries
+        self.disk_max_bytes = disk_max_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = open_sqlite(path, SCHEMA)
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+            row = self._db.execute("SELECT value FROM analyses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            with self._db:
+                self._db.execute("UPDATE analyses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self._remember(key, row[0])
+            return row[0]
+
+    def put(self, key, value):
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            self._remember(key, value)
+            with self._db:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO analyses VALUES (?, ?, ?, ?)", (key, value, size, time.time())
+                )
+                self._evict()
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM analyses").fetchone()[0]
+        if total <= self.disk_max_bytes:
+            return
+        for key, size in self._db.execute("SELECT key, size FROM analyses ORDER BY accessed_at").fetchall():
+            self._db.execute("DELETE FROM analyses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.disk_max_bytes:
+                break
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,304 @@
+# batch.py
+#
+# Offline personality analysis over Spotify data exports, no Streamlit or OAuth involved.
+#
+#   python batch.py exports/ -o results.jsonl --workers 8 --llm-concurrency 4 --backend fake
+#
+# Every sub-directory of exports/ is one user's unpacked "Spotify Account Data" or
+# "Extended Streaming History" download. Results are appended to the JSONL file as they
+# finish, so re-running the same command resumes where a crashed run stopped.
+
+import argparse
+import glob
+import hashlib
+import importlib
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+
+from logic import (
+    SOURCE_LIMITS,
+    SOURCE_WEIGHTS,
+    SOURCES,
+    TRAITS,
+    analysis_fingerprint,
+    build_music_prompt,
+    deduplicate_and_weight,
+    get_personality_traits,
+    tracks_frame,
+)
+
+# Spotify only counts a play towards recently played / top tracks after 30 seconds
+MIN_PLAY_MS = 30_000
+
+# Top tracks are rebuilt from plays in this window before the user's latest play (Spotify's medium_term)
+TOP_TRACKS_WINDOW = timedelta(days=182)
+
+LIBRARY_FILES = ("YourLibrary.json",)
+HISTORY_FILES = ("Streaming_History_Audio_*.json", "StreamingHistory_music_*.json", "StreamingHistory[0-9]*.json")
+
+
+def _load_json_files(user_dir, patterns):
+    records = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(os.path.join(user_dir, "**", pattern), recursive=True)):
+            with open(path, encoding="utf-8") as f:
+                records.append(json.load(f))
+    return records
+
+
+def _track_id(uri):
+    if uri and uri.startswith("spotify:track:"):
+        return uri.rsplit(":", 1)[1]
+    return None
+
+
+def _name_key(artist, name):
+    return f"{(artist or '').casefold()}\t{(name or '').casefold()}"
+
+
+def _synthetic_id(key):
+    # Stable stand-in for tracks the export never gives a URI for (account-data history, local files)
+    return "export:" + hashlib.sha1(key.encode("utf-8")).hexdigest()[:22]
+
+
+def read_export(user_dir):
+    """Normalize one export into liked tracks and plays: dicts of track_id, name, artist (+ ts, ms)."""
+    liked = []
+    for library in _load_json_files(user_dir, LIBRARY_FILES):
+        for track in library.get("tracks", []):
+            liked.append({"uri": track.get("uri"), "name": track.get("track"), "artist": track.get("artist")})
+
+    plays = []
+    for history in _load_json_files(user_dir, HISTORY_FILES):
+        for play in history:
+            if "ts" in play:
+                # Extended streaming history
+                if not play.get("master_metadata_track_name"):
+                    continue  # podcast episode or audiobook
+                plays.append({
+                    "uri": play.get("spotify_track_uri"),
+                    "name": play["master_metadata_track_name"],
+                    "artist": play.get("master_metadata_album_artist_name"),
+                    "ts": datetime.fromisoformat(play["ts"].replace("Z", "+00:00")).replace(tzinfo=None),
+                    "ms": play.get("ms_played", 0),
+                })
+            else:
+                # Account data history has no URIs and minute-resolution end times
+                plays.append({
+                    "uri": None,
+                    "name": play.get("trackName"),
+                    "artist": play.get("artistName"),
+                    "ts": datetime.strptime(play["endTime"], "%Y-%m-%d %H:%M"),
+                    "ms": play.get("msPlayed", 0),
+                })
+
+    # Resolve every record to one id, borrowing URIs across files by artist + name when missing
+    uris = {_name_key(r["artist"], r["name"]): r["uri"] for r in liked + plays if _track_id(r["uri"])}
+    for record in liked + plays:
+        key = _name_key(record["artist"], record["name"])
+        record["track_id"] = _track_id(record["uri"]) or _track_id(uris.get(key)) or _synthetic_id(key)
+    return liked, [play for play in plays if play["ms"] >= MIN_PLAY_MS]
+
+
+def export_frame(user_dir, limits=None):
+    """Rebuild the frame fetch_all_spotify_data would have produced for this user."""
+    limits = {**SOURCE_LIMITS, **(limits or {})}
+    liked, plays = read_export(user_dir)
+    plays.sort(key=lambda play: play["ts"])
+
+    top = []
+    if plays:
+        since = plays[-1]["ts"] - TOP_TRACKS_WINDOW
+        played_ms, tracks = {}, {}
+        for play in plays:
+            if play["ts"] >= since:
+                played_ms[play["track_id"]] = played_ms.get(play["track_id"], 0) + play["ms"]
+                tracks[play["track_id"]] = play
+        top = [tracks[track_id] for track_id in sorted(played_ms, key=played_ms.get, reverse=True)]
+
+    rows = {
+        "top": top[:limits["top"]],
+        "liked": liked[:limits["liked"]],
+        "recent": plays[-limits["recent"]:][::-1] if limits["recent"] else [],
+    }
+    records = [(source, record) for source in SOURCES for record in rows[source]]
+    return tracks_frame(
+        [record["track_id"] for _, record in records],
+        [record["name"] for _, record in records],
+        [record["artist"] or "" for _, record in records],
+        [[] for _ in records],
+        [SOURCE_WEIGHTS[source] for source, _ in records],
+        [SOURCES.index(source) for source, _ in records],
+    )
+
+
+def prepare_user(user_dir):
+    # Runs in a worker process: everything CPU-bound up to the LLM call
+    started = time.perf_counter()
+    user_id = os.path.basename(os.path.normpath(user_dir))
+    try:
+        df = deduplicate_and_weight(export_frame(user_dir))
+        if df.empty:
+            # Nothing to analyze; an LLM call would only invent traits (and be billed for it)
+            return {"user_id": user_id, "tracks": 0, "error": "NoTracks: export has no library or qualifying plays"}
+        prompt, _ = build_music_prompt(df)
+        return {
+            "user_id": user_id,
+            "prompt": prompt,
+            "fingerprint": analysis_fingerprint(df),
+            "tracks": len(df),
+            "prepare_seconds": time.perf_counter() - started,
+        }
+    except Exception as e:
+        return {"user_id": user_id, "error": f"{type(e).__name__}: {e}"}
+
+
+# --- LLM backends: callables taking (prompt, fingerprint) and returning the trait breakdown text ---
+
+def gemini_backend(prompt, fingerprint):
+    return get_personality_traits(prompt, fingerprint=fingerprint).content
+
+
+class FakeBackend:
+    """Deterministic local stand-in for Gemini: same prompt, same answer, with simulated latency."""
+
+    def __init__(self, latency=0.0, jitter=0.0):
+        self.latency = latency
+        self.jitter = jitter
+
+    def __call__(self, prompt, fingerprint):
+        rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).digest())
+        time.sleep(max(0.0, self.latency + rng.uniform(-self.jitter, self.jitter)))
+        traits = rng.sample(TRAITS, 6)
+        cuts = sorted(rng.sample(range(1, 100), 5))
+        shares = [b - a for a, b in zip([0] + cuts, cuts + [100])]
+        return "\n".join(f"🎧 {trait}: {share}%" for trait, share in zip(traits, sorted(shares, reverse=True)))
+
+
+BACKENDS = {"gemini": lambda args: gemini_backend, "fake": lambda args: FakeBackend(args.fake_latency)}
+
+
+def load_backend(args):
+    if args.backend in BACKENDS:
+        return BACKENDS[args.backend](args)
+    # Anything else is an import path to a backend callable: "package.module:attribute"
+    module, _, attribute = args.backend.partition(":")
+    return getattr(importlib.import_module(module), attribute)
+
+
+def analyze_prepared(prepared, backend):
+    if "error" in prepared:
+        return prepared
+    started = time.perf_counter()
+    result = {key: prepared[key] for key in ("user_id", "fingerprint", "tracks", "prepare_seconds")}
+    try:
+        result["traits"] = backend(prepared["prompt"], prepared["fingerprint"])
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["llm_seconds"] = time.perf_counter() - started
+    return result
+
+
+def read_results(output):
+    if not os.path.exists(output):
+        return
+    with open(output, encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn last line from a crash
+
+
+def completed_users(output):
+    # Users with an error line are retried on resume; only successful analyses are skipped
+    return {record["user_id"] for record in read_results(output) if "traits" in record}
+
+
+def latest_results(output):
+    """One record per user: the last successful analysis, else the last error."""
+    latest = {}
+    for record in read_results(output):
+        previous = latest.get(record["user_id"])
+        if previous is None or "traits" in record or "traits" not in previous:
+            latest[record["user_id"]] = record
+    return list(latest.values())
+
+
+def _end_torn_line(output):
+    # A crash mid-write leaves a partial last line; terminate it so the next result isn't glued onto it
+    if os.path.exists(output) and os.path.getsize(output):
+        with open(output, "rb+") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+
+
+def run_batch(user_dirs, output, backend, workers=None, llm_concurrency=4, log=print):
+    done = completed_users(output)
+    todo = [d for d in user_dirs if os.path.basename(os.path.normpath(d)) not in done]
+    log(f"{len(user_dirs)} users, {len(done)} already analyzed, {len(todo)} to go")
+    counts = {"ok": 0, "error": 0}
+    started = time.perf_counter()
+
+    def write(futures):
+        for future in futures:
+            result = future.result()
+            counts["error" if "error" in result else "ok"] += 1
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+        out.flush()
+
+    _end_torn_line(output)
+    with open(output, "a", encoding="utf-8") as out, \
+            ProcessPoolExecutor(max_workers=workers) as processes, \
+            ThreadPoolExecutor(max_workers=llm_concurrency) as llm_pool:
+        in_flight = set()
+        for prepared in processes.map(prepare_user, todo, chunksize=4):
+            # Keep at most two waves of LLM calls queued so prepared prompts don't pile up in memory
+            while len(in_flight) >= 2 * llm_concurrency:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                write(finished)
+            in_flight.add(llm_pool.submit(analyze_prepared, prepared, backend))
+        write(wait(in_flight).done)
+
+    elapsed = time.perf_counter() - started
+    log(f"{counts['ok']} analyzed, {counts['error']} failed in {elapsed:.1f}s "
+        f"({len(todo) / elapsed if elapsed else 0:.1f} users/s)")
+    return counts
+
+
+def export_parquet(output, parquet_path):
+    import pandas as pd
+
+    # A resumed run appends to the same file, so it can hold retried errors next to the retry's result
+    pd.DataFrame(latest_results(output)).to_parquet(parquet_path, index=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze Spotify data exports in bulk.")
+    parser.add_argument("exports", help="directory with one sub-directory per user export")
+    parser.add_argument("-o", "--output", default="results.jsonl", help="JSONL file results are appended to")
+    parser.add_argument("--parquet", help="also write all results to this Parquet file when done")
+    parser.add_argument("--workers", type=int, default=None, help="processes preparing prompts (default: CPUs)")
+    parser.add_argument("--llm-concurrency", type=int, default=4, help="LLM calls in flight at once")
+    parser.add_argument("--backend", default="gemini", help="gemini, fake, or module:callable")
+    parser.add_argument("--fake-latency", type=float, default=0.0, help="seconds per call for --backend fake")
+    args = parser.parse_args(argv)
+
+    user_dirs = sorted(
+        os.path.join(args.exports, name) for name in os.listdir(args.exports)
+        if os.path.isdir(os.path.join(args.exports, name))
+    )
+    counts = run_batch(user_dirs, args.output, load_backend(args), args.workers, args.llm_concurrency)
+    if args.parquet:
+        export_parquet(args.output, args.parquet)
+    return 1 if counts["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+# benchmarks/bench_dedupe.py
+#
+# Compares the vectorized deduplicate_and_weight against the original per-group lambda.
+# Run from the repo root: python benchmarks/bench_dedupe.py [--sizes 1000 10000 100000]
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from logic import SOURCE_WEIGHTS, SOURCES, deduplicate_and_weight, tracks_frame
+
+
+def reference_deduplicate_and_weight(df):
+    df = df.groupby(['track_id', 'track_name', 'artists']).agg({
+        'weight': 'sum',
+        'source': lambda x: ', '.join(sorted(set(x)))
+    }).reset_index()
+    return df
+
+
+def synthetic_frame(rows, seed=0):
+    # About half the rows repeat a track so groups mix one, two and three sources
+    rng = np.random.default_rng(seed)
+    track_numbers = rng.integers(0, max(rows // 2, 1), size=rows)
+    codes = rng.integers(0, len(SOURCES), size=rows).astype("int8")
+    artist_numbers = track_numbers % max(rows // 20, 1)
+    return tracks_frame(
+        [f"track{n:07d}" for n in track_numbers],
+        [f"Song {n}" for n in track_numbers],
+        [f"Artist {n}" for n in artist_numbers],
+        [[f"artist{n:06d}"] for n in artist_numbers],
+        np.array([SOURCE_WEIGHTS[source] for source in SOURCES])[codes],
+        codes,
+    )
+
+
+def best_of(fn, df, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(df)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'groups':>8} {'reference':>12} {'vectorized':>12} {'speedup':>8}")
+    for rows in args.sizes:
+        df = synthetic_frame(rows)
+        reference_time, expected = best_of(reference_deduplicate_and_weight, df, args.repeat)
+        vectorized_time, actual = best_of(deduplicate_and_weight, df, args.repeat)
+        actual = actual.drop(columns="artist_ids")
+        pd.testing.assert_frame_equal(
+            actual.astype({"source": str}), expected.astype({"source": str}), check_dtype=False
+        )
+        print(f"{rows:>8} {len(actual):>8} {reference_time * 1000:>10.1f}ms {vectorized_time * 1000:>10.1f}ms "
+              f"{reference_time / vectorized_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# benchmarks/bench_hedge.py
+#
+# Trait-analysis latency against FakeChatModel with a heavy-tailed latency distribution, called
+# directly and through llm_hedge's HedgedCaller (hedge only, then hedge plus a local fallback).
+# Reports p50/p95/p99/max, which path answered how often, and the extra model calls hedging cost.
+# Run from the repo root:
+#   python benchmarks/bench_hedge.py [--calls 400 --slow-share 0.05 --slow-latency 3 --deadline 1.5]
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fakes import TRAIT_RESPONSE, FakeChatModel  # noqa: E402
+from llm_hedge import HedgedCaller  # noqa: E402
+
+PROMPT = "Analyze the personality of someone who listens to these songs."
+
+
+def latency_distribution(args):
+    # Most calls are fast with some spread; a few hit a slow replica or a queue
+    rng = random.Random(args.seed)
+    lock = threading.Lock()
+
+    def draw():
+        with lock:
+            if rng.random() < args.slow_share:
+                return rng.uniform(args.slow_latency, 2 * args.slow_latency)
+            return rng.lognormvariate(0, 0.25) * args.latency
+
+    return draw
+
+
+def percentiles(values):
+    ordered = sorted(values)
+    return {
+        **{f"p{p}": ordered[min(int(len(ordered) * p / 100), len(ordered) - 1)] for p in (50, 95, 99)},
+        "max": ordered[-1],
+    }
+
+
+def run(mode, args):
+    model = FakeChatModel(latency=latency_distribution(args))
+    executor = ThreadPoolExecutor(max_workers=args.concurrency * 3, thread_name_prefix="llm")
+    caller = HedgedCaller("bench", deadline=args.deadline, percentile=args.percentile, executor=executor)
+    fallback = (lambda: TRAIT_RESPONSE) if mode == "hedged+fallback" else None
+    paths = Counter()
+    lock = threading.Lock()
+
+    def one(_):
+        started = time.perf_counter()
+        if mode == "direct":
+            model.invoke(PROMPT)
+            path = "primary"
+        else:
+            try:
+                _, path = caller.call(lambda: model.invoke(PROMPT), fallback)
+            except TimeoutError:
+                path = "timeout"
+        with lock:
+            paths[path] += 1
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        latencies = list(pool.map(one, range(args.calls)))
+    executor.shutdown(wait=True)
+    return {"latency": percentiles(latencies), "paths": dict(paths), "model_calls": model.calls}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.2, help="median seconds of a normal call")
+    parser.add_argument("--slow-share", type=float, default=0.05, help="share of calls that are slow")
+    parser.add_argument("--slow-latency", type=float, default=3.0, help="slow calls take 1-2x this")
+    parser.add_argument("--deadline", type=float, default=1.5)
+    parser.add_argument("--percentile", type=float, default=90, help="hedge once slower than this percentile")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{args.calls} calls, {args.concurrency} at a time; {args.slow_share:.0%} take "
+          f"{args.slow_latency:.1f}-{2 * args.slow_latency:.1f}s, deadline {args.deadline:.1f}s")
+    for mode in ("direct", "hedged", "hedged+fallback"):
+        result = run(mode, args)
+        extra = result["model_calls"] / args.calls - 1
+        print(f"  {mode:<16} " + "  ".join(f"{name} {value * 1000:>7.0f}ms" for name, value in result["latency"].items())
+              + f"  +{extra:.1%} calls  " + ", ".join(f"{path} {count}" for path, count in sorted(result["paths"].items())))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+# benchmarks/bench_pipeline.py
+#
+# Stage-by-stage timing of the whole analysis pipeline against the fakes in fakes.py:
+# fetch -> dedupe -> genres -> prompt -> fingerprint -> traits -> chain -> chat, per library size.
+# Reports median seconds, tracks/s and tracemalloc peak per stage, and compares against a saved
+# baseline so a regression fails the run. Baselines are machine specific; save one locally first.
+# Run from the repo root:
+#   python benchmarks/bench_pipeline.py --save-baseline
+#   python benchmarks/bench_pipeline.py [--sizes 50,1000,10000,100000 --tolerance 0.25]
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from clients import ClientRegistry, set_registry  # noqa: E402
+from fakes import FakeChatModel, FakeSpotify  # noqa: E402
+from genres import ArtistGenreCache, genre_summary, genre_weights, local_trait_summary, resolve_artist_genres  # noqa: E402
+from logic import (  # noqa: E402
+    TRAIT_MODEL,
+    TRAIT_TEMPERATURE,
+    analysis_fingerprint,
+    build_music_prompt,
+    deduplicate_and_weight,
+    fetch_all_spotify_data,
+    get_personality_traits,
+    setup_conversational_chain,
+    stream_chat_reply,
+)
+
+BASELINE = os.path.join(ROOT, "benchmarks", "baseline.json")
+STAGES = ("fetch", "dedupe", "genres", "prompt", "fingerprint", "traits", "chain", "chat", "end_to_end")
+CHAT_QUESTION = "If I were a Harry Potter house, which one would I be?"
+
+# Stages this fast are dominated by timer noise; don't fail them on relative drift alone
+MIN_REGRESSION_SECONDS = 0.005
+
+
+def run_pipeline(sp, size, stage_done):
+    started = time.perf_counter()
+    df = fetch_all_spotify_data(sp, limits={"top": min(200, size), "liked": size, "recent": 50})
+    stage_done("fetch")
+    df = deduplicate_and_weight(df)
+    stage_done("dedupe")
+    # A fresh in-memory genre cache each run, so every run pays for resolving genres
+    genres = resolve_artist_genres(sp, [a for ids in df["artist_ids"] for a in ids], cache=ArtistGenreCache(":memory:"))
+    weights = genre_weights(df, genres)
+    summary = genre_summary(weights)
+    local_trait_summary(weights)
+    stage_done("genres")
+    prompt, song_list = build_music_prompt(df, genre_summary=summary)
+    stage_done("prompt")
+    analysis_fingerprint(df, genre_seeded=bool(summary))
+    stage_done("fingerprint")
+    trait_summary = get_personality_traits(prompt).content
+    stage_done("traits")
+    chain = setup_conversational_chain(trait_summary, song_list)
+    stage_done("chain")
+    for _ in stream_chat_reply(chain, CHAT_QUESTION):
+        pass
+    stage_done("chat")
+    return len(df), time.perf_counter() - started
+
+
+def time_stages(sp, size):
+    seconds = {}
+    last = [time.perf_counter()]
+
+    def stage_done(stage):
+        now = time.perf_counter()
+        seconds[stage] = now - last[0]
+        last[0] = now
+
+    tracks, seconds["end_to_end"] = run_pipeline(sp, size, stage_done)
+    return tracks, seconds
+
+
+def peak_memory(sp, size):
+    # A separate pass: tracemalloc slows allocation-heavy stages too much to time under it
+    peaks = {}
+    tracemalloc.start()
+
+    def stage_done(stage):
+        peaks[stage] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.reset_peak()
+
+    try:
+        run_pipeline(sp, size, stage_done)
+        peaks["end_to_end"] = max(peaks.values())
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+
+def bench_size(size, repeat, spotify_latency, llm_latency):
+    model = FakeChatModel(latency=llm_latency)
+    registry = ClientRegistry()
+    registry.get(("chat_model", TRAIT_MODEL, TRAIT_TEMPERATURE), lambda: model)
+    set_registry(registry)
+    sp = FakeSpotify(saved=size, top=min(200, size), latency=spotify_latency)
+
+    time_stages(sp, size)  # warm-up: first-call imports and lazily built clients
+    runs = [time_stages(sp, size) for _ in range(repeat)]
+    tracks = runs[0][0]
+    peaks = peak_memory(sp, size)
+    result = {}
+    for stage in STAGES:
+        seconds = statistics.median(run[1][stage] for run in runs)
+        result[stage] = {
+            "seconds": seconds,
+            "tracks_per_second": tracks / seconds if seconds else None,
+            "peak_mb": peaks[stage] / 2**20,
+        }
+    return tracks, result
+
+
+def compare(results, baseline, tolerance, memory_tolerance):
+    failures = []
+    for size, stages in results.items():
+        for stage, measured in stages.items():
+            base = baseline.get(size, {}).get(stage)
+            if base is None:
+                continue
+            if (measured["seconds"] > base["seconds"] * (1 + tolerance)
+                    and measured["seconds"] - base["seconds"] > MIN_REGRESSION_SECONDS):
+                failures.append(f"{size} tracks / {stage}: {measured['seconds'] * 1000:.1f}ms "
+                                f"vs baseline {base['seconds'] * 1000:.1f}ms")
+            if measured["peak_mb"] > base["peak_mb"] * (1 + memory_tolerance) and measured["peak_mb"] - base["peak_mb"] > 1:
+                failures.append(f"{size} tracks / {stage}: peak {measured['peak_mb']:.1f}MB "
+                                f"vs baseline {base['peak_mb']:.1f}MB")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="50,1000,10000,100000", help="comma-separated liked-library sizes")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per size; the median is reported")
+    parser.add_argument("--spotify-latency", type=float, default=0.0, help="seconds per fake Spotify request")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds before the fake model answers")
+    parser.add_argument("--baseline", default=BASELINE, help="baseline JSON to compare against / save to")
+    parser.add_argument("--save-baseline", action="store_true", help="write this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown per stage")
+    parser.add_argument("--memory-tolerance", type=float, default=0.25, help="allowed relative peak memory growth")
+    parser.add_argument("--json", help="also write this run's results to this file")
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore")
+
+    results = {}
+    for size in (int(s) for s in args.sizes.split(",")):
+        tracks, stages = bench_size(size, args.repeat, args.spotify_latency, args.llm_latency)
+        results[str(size)] = stages
+        print(f"{size} liked tracks ({tracks} after dedupe):")
+        for stage, measured in stages.items():
+            rate = measured["tracks_per_second"]
+            print(f"  {stage:<12} {measured['seconds'] * 1000:>9.1f}ms {rate or 0:>12,.0f} tracks/s "
+                  f"{measured['peak_mb']:>8.1f}MB peak")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}; run with --save-baseline to record one")
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as f:
+        failures = compare(results, json.load(f), args.tolerance, args.memory_tolerance)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+# benchmarks/bench_startup.py
+#
+# Cold-start budget: import time of the app's own modules and time-to-first-render of the
+# `start` stage, each measured in a fresh interpreter. Exits non-zero when a budget is blown
+# or when a heavy dependency sneaks back into the landing-page import path.
+# Run from the repo root: python benchmarks/bench_startup.py [--max-import-ms 250 --max-render-ms 1500]
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+APP_MODULES = ("logic", "library_cache", "analysis_cache", "clients", "tracing", "rate_limit", "session_store", "llm_hedge")
+
+# Only needed once the user clicks Connect / Reveal / chats; never on the landing page
+HEAVY_MODULES = ("pandas", "numpy", "spotipy", "langchain", "langchain_core", "langchain_google_genai")
+
+RENDER_SCRIPT = """
+import json, sys, time, warnings
+warnings.filterwarnings("ignore")
+from streamlit.testing.v1 import AppTest
+started = time.perf_counter()
+app = AppTest.from_file("App.py", default_timeout=60).run()
+render_ms = (time.perf_counter() - started) * 1000
+print(json.dumps({
+    "render_ms": render_ms,
+    "stage": app.session_state.stage,
+    "exceptions": [e.value for e in app.exception],
+    "heavy_loaded": [name for name in %r if name in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+
+def run_python(args):
+    return subprocess.run([sys.executable, *args], cwd=ROOT, capture_output=True, text=True, check=True)
+
+
+def import_breakdown():
+    # -X importtime lines: "import time: self [us] | cumulative | imported package", children
+    # printed (one level deeper) before their parent; interpreter startup modules are skipped
+    result = run_python(["-X", "importtime", "-c", "import " + ", ".join(APP_MODULES)])
+    totals, children, pending = {}, {}, []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            pending.append((name.strip(), int(cumulative) / 1000))
+        elif depth == 0:
+            if name.strip() in APP_MODULES:
+                totals[name.strip()] = int(cumulative) / 1000
+                children.update(pending)
+            pending = []
+    return totals, children
+
+
+def first_render():
+    return json.loads(run_python(["-c", RENDER_SCRIPT]).stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-import-ms", type=float, default=250.0)
+    parser.add_argument("--max-render-ms", type=float, default=1500.0)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    totals, children = import_breakdown()
+    import_ms = sum(totals.values())
+    print(f"import {', '.join(APP_MODULES)}: {import_ms:.1f}ms")
+    for name, ms in totals.items():
+        print(f"  {name:<32} {ms:>8.1f}ms")
+    print("heaviest dependencies:")
+    for name, ms in sorted(children.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {name:<32} {ms:>8.1f}ms")
+
+    render = first_render()
+    print(f"first render of '{render['stage']}' stage: {render['render_ms']:.1f}ms")
+
+    failures = []
+    if import_ms > args.max_import_ms:
+        failures.append(f"import time {import_ms:.1f}ms exceeds {args.max_import_ms:.0f}ms")
+    if render["render_ms"] > args.max_render_ms:
+        failures.append(f"first render {render['render_ms']:.1f}ms exceeds {args.max_render_ms:.0f}ms")
+    if render["heavy_loaded"]:
+        failures.append(f"landing page imported {', '.join(render['heavy_loaded'])}")
+    if render["exceptions"]:
+        failures.append(f"landing page raised {render['exceptions']}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# benchmarks/check_library_cache.py
+#
+# Regression check for library_cache's incremental refresh against FakeSpotify: a full crawl, then
+# incremental liked and recent refreshes, including a user whose library was empty at the crawl.
+# Exits non-zero on the first mismatch. Run from the repo root:
+#   python benchmarks/check_library_cache.py
+
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fakes import FakeSpotify  # noqa: E402
+from library_cache import LibraryStore, fetch_cached_spotify_data  # noqa: E402
+
+# Every sync after the first one refreshes liked and recent incrementally
+TTLS = {"liked": 0, "recent": 0}
+
+
+def sync(store, sp):
+    df = fetch_cached_spotify_data(sp, store=store)
+    return {source: int((df["source"] == source).sum()) for source in ("top", "liked", "recent")}
+
+
+def check(name, got, expected):
+    if got != expected:
+        raise SystemExit(f"FAIL {name}: expected {expected}, got {got}")
+    print(f"ok   {name}")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = LibraryStore(os.path.join(tmp, "library.sqlite3"), ttls=TTLS)
+
+        check("full crawl", sync(store, FakeSpotify(saved=120, user_id="full")), {"top": 50, "liked": 120, "recent": 50})
+        check("incremental liked and recent", sync(store, FakeSpotify(saved=120, user_id="full")),
+              {"top": 50, "liked": 120, "recent": 50})
+        modes = {source: store.sync_state("full", source) is not None for source in ("liked", "recent")}
+        check("sync state recorded", modes, {"liked": True, "recent": True})
+
+        check("empty liked library", sync(store, FakeSpotify(saved=0, user_id="empty")), {"top": 50, "liked": 0, "recent": 50})
+        check("first likes after an empty crawl", sync(store, FakeSpotify(saved=5, user_id="empty")),
+              {"top": 50, "liked": 5, "recent": 50})
+        store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+# benchmarks/check_rate_limit.py
+#
+# Regression check that a Spotify 429 reaches rate_limit.py instead of being retried inside urllib3:
+# a local server answers 429 with Retry-After once, then 200, to a real spotipy client on the
+# session clients.py builds. The scheduler must see the 429 and pause the shared RateLimiter for
+# the Retry-After. Exits non-zero on the first mismatch. Run from the repo root:
+#   python benchmarks/check_rate_limit.py
+
+import json
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from clients import build_spotify_session  # noqa: E402
+from rate_limit import RateLimiter, ScheduledSpotify, SpotifyScheduler  # noqa: E402
+
+RETRY_AFTER = 1
+
+
+class RateLimitedHandler(BaseHTTPRequestHandler):
+    requests_seen = 0
+
+    def do_GET(self):
+        type(self).requests_seen += 1
+        if type(self).requests_seen == 1:
+            self.send_response(429)
+            self.send_header("Retry-After", str(RETRY_AFTER))
+            body = json.dumps({"error": {"status": 429, "message": "API rate limit exceeded"}}).encode("utf-8")
+        else:
+            self.send_response(200)
+            body = json.dumps({"id": "check-user"}).encode("utf-8")
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RecordingLimiter(RateLimiter):
+    def __init__(self):
+        super().__init__()
+        self.pauses = []
+
+    def pause(self, seconds):
+        self.pauses.append(seconds)
+        super().pause(seconds)
+
+
+def check(name, got, expected):
+    if got != expected:
+        raise SystemExit(f"FAIL {name}: expected {expected}, got {got}")
+    print(f"ok   {name}")
+
+
+def main():
+    import spotipy
+
+    session = build_spotify_session()
+    retry = session.get_adapter("https://api.spotify.com").max_retries
+    check("urllib3 leaves 429 alone", retry.is_retry("GET", 429, has_retry_after=True), False)
+    check("urllib3 still retries 503", retry.is_retry("GET", 503, has_retry_after=False), True)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RateLimitedHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        sp = spotipy.Spotify(auth="check-token", requests_session=session)
+        sp.prefix = f"http://127.0.0.1:{server.server_address[1]}/v1/"
+        limiter = RecordingLimiter()
+        user = ScheduledSpotify(sp, SpotifyScheduler(limiter), key="check").current_user()
+    finally:
+        server.shutdown()
+    check("answer after the pause", user["id"], "check-user")
+    check("Retry-After reaches RateLimiter.pause", limiter.pauses, [float(RETRY_AFTER)])
+    check("requests sent", RateLimitedHandler.requests_seen, 2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+# benchmarks/fakes.py
+#
+# Latency-configurable stand-ins for Spotify and Gemini, shared by the benchmarks and load tests.
+
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+GENRES = (
+    "dance pop", "indie folk", "dark trap", "lo-fi beats", "classic rock", "k-pop", "neo soul",
+    "melodic metal", "bedroom pop", "synthwave", "latin pop", "ambient", "country road", "jazz fusion",
+)
+
+TRAIT_RESPONSE = "\n".join((
+    "🎧 🧘 Zen Seeker: 28%",
+    "🎧 🎨 ArtSoul Explorer: 22%",
+    "🎧 🫥 Melancholic Thinker: 18%",
+    "🎧 🚗 Roadtrip Junkie: 14%",
+    "🎧 🕺 Party Starter: 10%",
+    "🎧 🧠 Deep Diver: 8%",
+))
+
+
+def _delay(latency):
+    # A latency is either fixed seconds or a zero-argument callable drawing from a distribution
+    return max(0.0, latency() if callable(latency) else latency)
+
+
+class FakeSpotify:
+    """spotipy.Spotify look-alike serving a synthetic library in Spotify's paged payload shapes."""
+
+    def __init__(self, saved=500, top=50, recent=50, artists=None, latency=0.0, seed=0, user_id="fake-user"):
+        self.saved, self.top, self.recent = saved, top, recent
+        self.artist_count = artists or max(saved // 8, 10)
+        self.latency = latency
+        self.user_id = user_id
+        self.calls = 0
+        self._calls_lock = threading.Lock()
+        rng = random.Random(seed)
+        self._track_artists = [rng.randrange(self.artist_count) for _ in range(max(saved, top, recent))]
+        self._top_order = rng.sample(range(len(self._track_artists)), top)
+        self._recent_order = [rng.randrange(len(self._track_artists)) for _ in range(recent)]
+        self._genres = [rng.sample(GENRES, rng.randint(0, 3)) for _ in range(self.artist_count)]
+        self._epoch = datetime(2024, 6, 1)
+
+    def _request(self):
+        with self._calls_lock:
+            self.calls += 1
+        time.sleep(_delay(self.latency))
+
+    def _artist(self, number):
+        return {
+            "id": f"artist{number:06d}",
+            "name": f"Artist {number}",
+            "type": "artist",
+            "uri": f"spotify:artist:artist{number:06d}",
+        }
+
+    def _track(self, number):
+        track_id = f"track{number:07d}"
+        artists = [self._artist(self._track_artists[number])]
+        if number % 7 == 0:
+            artists.append(self._artist((self._track_artists[number] + 1) % self.artist_count))
+        return {
+            "id": track_id,
+            "name": f"Song {number}",
+            "artists": artists,
+            "album": {"id": f"album{number // 10:06d}", "name": f"Album {number // 10}", "artists": artists[:1]},
+            "duration_ms": 180_000 + number % 120_000,
+            "explicit": number % 5 == 0,
+            "popularity": number % 100,
+            "uri": f"spotify:track:{track_id}",
+            "type": "track",
+        }
+
+    def _page(self, items, total, limit, offset):
+        return {
+            "items": items,
+            "total": total,
+            "limit": limit,
+            "offset": offset,
+            "next": f"https://api.spotify.com/v1/fake?offset={offset + limit}" if offset + limit < total else None,
+            "previous": None,
+        }
+
+    def current_user(self):
+        self._request()
+        return {"id": self.user_id, "display_name": "Fake User"}
+
+    def current_user_top_tracks(self, limit=20, offset=0, time_range="medium_term"):
+        self._request()
+        numbers = self._top_order[offset:offset + limit]
+        return self._page([self._track(n) for n in numbers], self.top, limit, offset)
+
+    def current_user_saved_tracks(self, limit=20, offset=0, market=None):
+        self._request()
+        items = [
+            {"added_at": (self._epoch - timedelta(hours=n)).strftime("%Y-%m-%dT%H:%M:%SZ"), "track": self._track(n)}
+            for n in range(offset, min(offset + limit, self.saved))
+        ]
+        return self._page(items, self.saved, limit, offset)
+
+    def current_user_recently_played(self, limit=50, after=None, before=None):
+        self._request()
+        items = [
+            {"played_at": (self._epoch - timedelta(minutes=4 * i)).strftime("%Y-%m-%dT%H:%M:%S.000Z"), "track": self._track(n)}
+            for i, n in enumerate(self._recent_order[:limit])
+        ]
+        return {"items": items, "cursors": {"after": str(int(self._epoch.timestamp() * 1000))}, "limit": limit, "next": None}
+
+    def artists(self, artists):
+        self._request()
+        return {"artists": [
+            {"id": artist_id, "name": f"Artist {int(artist_id[6:])}", "genres": self._genres[int(artist_id[6:])]}
+            for artist_id in artists
+        ]}
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model with configurable time-to-first-token and per-token latency; never calls out."""
+
+    response: str = TRAIT_RESPONSE
+    latency: Any = 0.0
+    token_latency: float = 0.0
+    calls: int = 0
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        tokens = self.response.split(" ")
+        time.sleep(_delay(self.latency) + self.token_latency * len(tokens))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.response))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        time.sleep(_delay(self.latency))
+        tokens = self.response.split(" ")
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token if i == 0 else " " + token))
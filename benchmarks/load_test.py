@@ -0,0 +1,202 @@
+# benchmarks/load_test.py
+#
+# Drives N simulated sessions through the real App.py flow (start -> Connect -> Reveal -> chat
+# turns) with Streamlit's AppTest, in one process, with Spotify and Gemini swapped for the
+# latency-configurable fakes in fakes.py. Reports p50/p95/p99 per stage, throughput, and how much
+# the process RSS grows per session kept alive, plus the server time a chat turn saves by rerunning
+# only the chat fragment instead of the whole results page (AppTest always runs the whole page, so
+# the saving is that page's time minus the fragment's).
+# Run from the repo root:
+#   python benchmarks/load_test.py --sessions 40 --concurrency 8 --llm-latency 0.8 --spotify-latency 0.05
+
+import argparse
+import itertools
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Every run starts from empty caches, so no session is served someone else's analysis
+os.environ["MIRROR_CACHE_DIR"] = tempfile.mkdtemp(prefix="mirror-load-")
+
+import logic  # noqa: E402
+from fakes import FakeChatModel, FakeSpotify  # noqa: E402
+from rate_limit import ScheduledSpotify  # noqa: E402
+
+# Chat turns answered from the precomputed sample answers are timed apart from live LLM turns
+STAGES = ("start", "connect", "reveal", "chat_sample", "chat_live")
+CHAT_QUESTIONS = (
+    "What Harry Potter house would I be in?",
+    "What would my theme song at a wedding be?",
+    "What car model would I be?",
+    "Which city should I move to?",
+    "Dating prompt: A life goal of mine...",
+    "What would I be famous for?",
+)
+
+
+def rss_bytes():
+    # Current RSS from /proc where available, else the peak getrusage reports
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def install_fakes(args):
+    users = itertools.count()
+    model = FakeChatModel(latency=args.llm_latency, token_latency=args.token_latency)
+
+    def connect_spotify(session_key=None):
+        user = next(users)
+        fake = FakeSpotify(saved=args.library_size, latency=args.spotify_latency, seed=user, user_id=f"load-user-{user}")
+        return ScheduledSpotify(fake)
+
+    logic.connect_spotify = connect_spotify
+    logic.get_chat_model = lambda *args, **kwargs: model
+    return model
+
+
+def allow_concurrent_app_tests():
+    # AppTest swaps a mock Runtime singleton and the appTest config flag in for each run and clears
+    # them afterwards, which breaks runs still going on other threads. Pin both for the whole test.
+    from unittest.mock import MagicMock
+
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+
+    fallback = MagicMock(spec=Runtime)
+    fallback.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    fallback.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime.instance = classmethod(lambda cls: cls._instance or fallback)
+    Runtime.exists = classmethod(lambda cls: True)
+    config.set_option("global.appTest", True)
+
+
+def run_session(session, chat_turns):
+    from streamlit.testing.v1 import AppTest
+
+    timings = {stage: [] for stage in STAGES}
+    timings["fragment_saving"] = []
+
+    def timed(stage, action):
+        started = time.perf_counter()
+        app = action()
+        timings[stage].append(time.perf_counter() - started)
+        problems = [e.value for e in app.exception] + [e.value for e in app.error]
+        if problems:
+            raise RuntimeError(f"session {session} failed in {stage}: {problems[0]}")
+        return app
+
+    app = AppTest.from_file(os.path.join(ROOT, "App.py"), default_timeout=300)
+    timed("start", app.run)
+    timed("connect", app.button(key="connect_button").click().run)
+    timed("reveal", app.button(key="reveal_button").click().run)
+    unasked_samples = {logic.normalize_question(question) for question in logic.SAMPLE_QUESTIONS}
+    for turn in range(chat_turns):
+        question = CHAT_QUESTIONS[(session + turn) % len(CHAT_QUESTIONS)]
+        stage = "chat_sample" if logic.normalize_question(question) in unasked_samples else "chat_live"
+        unasked_samples.discard(logic.normalize_question(question))
+        app = timed(stage, app.chat_input[0].set_value(question).run)
+        reruns = {timing["scope"]: timing["server_time"] for timing in list(app.session_state.rerun_timings)[-2:]}
+        timings["fragment_saving"].append(reruns["page"] - reruns["chat"])
+    if app.session_state.stage != "results":
+        raise RuntimeError(f"session {session} ended on stage {app.session_state.stage}")
+    return app, timings
+
+
+def percentiles(values):
+    ordered = sorted(values)
+
+    def rank(p):
+        position = (len(ordered) - 1) * p / 100
+        low = int(position)
+        high = min(low + 1, len(ordered) - 1)
+        return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+    return {f"p{p}": rank(p) for p in (50, 95, 99)} if ordered else {}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4, help="sessions driven at the same time")
+    parser.add_argument("--chat-turns", type=int, default=3)
+    parser.add_argument("--library-size", type=int, default=2000, help="liked tracks per fake user")
+    parser.add_argument("--spotify-latency", type=float, default=0.05, help="seconds per fake Spotify request")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds before the fake model answers")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="seconds per streamed token")
+    parser.add_argument("--max-chat-p95-ms", type=float, help="exit non-zero when live (non-sample) chat p95 exceeds this")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore")
+
+    model = install_fakes(args)
+    allow_concurrent_app_tests()
+    # One untimed session loads every import and warms the shared clients before RSS is sampled
+    run_session(-1, 1)
+    rss_before = rss_bytes()
+    lock = threading.Lock()
+    results = {stage: [] for stage in STAGES}
+    fragment_saving = []
+    alive = []
+
+    def drive(session):
+        app, timings = run_session(session, args.chat_turns)
+        with lock:
+            alive.append(app)  # keep the session's state alive, like an open browser tab
+            fragment_saving.extend(timings.pop("fragment_saving"))
+            for stage, values in timings.items():
+                results[stage] += values
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for future in [pool.submit(drive, session) for session in range(args.sessions)]:
+            future.result()
+    elapsed = time.perf_counter() - started
+    rss_growth = rss_bytes() - rss_before
+
+    report = {
+        "sessions": args.sessions,
+        "concurrency": args.concurrency,
+        "elapsed_seconds": elapsed,
+        "sessions_per_second": args.sessions / elapsed,
+        "chat_turns_per_second": (len(results["chat_sample"]) + len(results["chat_live"])) / elapsed,
+        "llm_calls": model.calls,
+        "rss_growth_bytes": rss_growth,
+        "rss_per_session_bytes": rss_growth / args.sessions,
+        "stages": {stage: percentiles(values) for stage, values in results.items()},
+        "fragment_saving": percentiles(fragment_saving),
+    }
+    print(f"{args.sessions} sessions, {args.concurrency} at a time, in {elapsed:.1f}s: "
+          f"{report['sessions_per_second']:.2f} sessions/s, {report['chat_turns_per_second']:.2f} chat turns/s")
+    for stage, stats in report["stages"].items():
+        print(f"  {stage:<12} " + "  ".join(f"{name} {value * 1000:>8.1f}ms" for name, value in stats.items()))
+    print("  server time a chat turn saves by rerunning only the chat fragment: "
+          + "  ".join(f"{name} {value * 1000:.1f}ms" for name, value in report["fragment_saving"].items()))
+    print(f"RSS grew {rss_growth / 2**20:.1f}MB, {report['rss_per_session_bytes'] / 2**10:.0f}KB per live session")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    chat_p95_ms = report["stages"]["chat_live"].get("p95", 0) * 1000
+    if args.max_chat_p95_ms is not None and chat_p95_ms > args.max_chat_p95_ms:
+        print(f"FAIL: live chat p95 {chat_p95_ms:.1f}ms exceeds {args.max_chat_p95_ms:.0f}ms")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+# chat_memory.py
+
+import threading
+
+from langchain.memory import ConversationSummaryBufferMemory
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, get_buffer_string
+from pydantic import Field, PrivateAttr
+
+from clients import get_registry
+from llm_hedge import hedged_call
+from logic import CHARS_PER_TOKEN, estimate_tokens
+from tracing import span, submit
+
+# Chat history budget on top of the pinned system prompt: recent turns verbatim, older ones summarized
+CHAT_MEMORY_TOKEN_LIMIT = 1500
+CHAT_WINDOW_TURNS = 6
+CHAT_SUMMARY_TOKEN_LIMIT = 300
+
+# Summaries being written at once across all sessions
+SUMMARY_WORKERS = 4
+
+
+def get_summary_executor():
+    from concurrent.futures import ThreadPoolExecutor
+
+    return get_registry().get(
+        "summary_executor",
+        lambda: ThreadPoolExecutor(max_workers=SUMMARY_WORKERS, thread_name_prefix="summaries"),
+    )
+
+
+class BoundedChatMemory(ConversationSummaryBufferMemory):
+    """Pinned system prompt + running summary + sliding window of turns, under a token ceiling."""
+
+    system_prompt: str
+    max_token_limit: int = CHAT_MEMORY_TOKEN_LIMIT
+    window_turns: int = CHAT_WINDOW_TURNS
+    summary_token_limit: int = CHAT_SUMMARY_TOKEN_LIMIT
+    # Estimated prompt tokens (system + summary + window + question) of every turn so far
+    prompt_tokens: list = Field(default_factory=list)
+    # Turns evicted from the window whose summary is still being written; they stay in the history until then
+    _unsummarized: list = PrivateAttr(default_factory=list)
+    _summary: object = PrivateAttr(default=None)
+    _lock: object = PrivateAttr(default_factory=threading.Lock)
+
+    def _snapshot(self):
+        # Summary and history read together, so a summary landing in between can't drop or repeat turns
+        with self._lock:
+            return self.moving_summary_buffer, self._unsummarized + self.chat_memory.messages
+
+    def load_memory_variables(self, inputs):
+        summary, history_messages = self._snapshot()
+        messages = [SystemMessage(content=self.system_prompt)]
+        if summary:
+            messages.append(SystemMessage(content=f"Summary of the earlier conversation: {summary}"))
+        history = get_buffer_string(messages + history_messages, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix)
+        if "input" in inputs:
+            self.prompt_tokens.append(estimate_tokens(history) + estimate_tokens(inputs["input"]))
+        return {self.memory_key: history}
+
+    def dump_state(self):
+        # Summary + window is all a worker needs to carry on the conversation; see session_store.py
+        summary, messages = self._snapshot()
+        return {"summary": summary, "window": [[message.type, message.content] for message in messages]}
+
+    def load_state(self, state):
+        self.moving_summary_buffer = state.get("summary", "")
+        self._unsummarized = []
+        self.chat_memory.messages = [
+            (HumanMessage if role == "human" else AIMessage)(content=content) for role, content in state.get("window", [])
+        ]
+
+    def _window_tokens(self, messages):
+        return sum(estimate_tokens(message.content) for message in messages)
+
+    def _over_budget(self, messages, turns):
+        return len(messages) > 2 and (len(messages) > 2 * turns or self._window_tokens(messages) > self.max_token_limit)
+
+    def prune(self):
+        # Token counts are estimated locally; asking Gemini to count would cost a round-trip per turn
+        messages = list(self.chat_memory.messages)
+        if not self._over_budget(messages, self.window_turns):
+            return
+        # Evict down to half the window at once, so a summary is written every few turns, not every turn
+        evicted = []
+        while self._over_budget(messages, max(self.window_turns // 2, 1)):
+            evicted += messages[:2]
+            messages = messages[2:]
+        with self._lock:
+            self.chat_memory.messages = messages
+            self._unsummarized += evicted
+            # Summaries that keep failing or lagging can't let the history grow past the budget: the
+            # oldest pending turns are dropped (an in-flight summary still covers them)
+            while len(self._unsummarized) > 2 and self._window_tokens(self._unsummarized) > self.max_token_limit:
+                del self._unsummarized[:2]
+            if self._summary is not None and not self._summary.done():
+                return  # folded into the next summary
+            pending = list(self._unsummarized)
+        # Written off the reply's critical path; until it lands the evicted turns stay in the history
+        self._summary = submit(get_summary_executor(), self._summarize, pending, self.moving_summary_buffer)
+
+    def _summarize(self, evicted, previous):
+        with span("chat.summarize", evicted_messages=len(evicted)):
+            summary, _ = hedged_call(
+                "chat.summary",
+                lambda: self.predict_new_summary(evicted, previous),
+                lambda: self._local_summary(evicted, previous),
+            )
+        summarized = {id(message) for message in evicted}
+        with self._lock:
+            self.moving_summary_buffer = summary[:self.summary_token_limit * CHARS_PER_TOKEN]
+            self._unsummarized = [message for message in self._unsummarized if id(message) not in summarized]
+        return summary
+
+    def _local_summary(self, evicted, previous):
+        # Without Gemini the evicted turns are appended verbatim and the summary keeps its newest part
+        text = "\n".join(filter(None, [previous, get_buffer_string(evicted, self.human_prefix, self.ai_prefix)]))
+        return text[-self.summary_token_limit * CHARS_PER_TOKEN:]
@@ -0,0 +1,96 @@
+# clients.py
+
+import os
+import threading
+
+# Spotify traffic goes to two hosts (api. and accounts.spotify.com); each keeps up to
+# SPOTIFY_POOL_MAXSIZE warm connections, enough for several sessions paging at once
+SPOTIFY_POOL_CONNECTIONS = 4
+SPOTIFY_POOL_MAXSIZE = 32
+
+# Same retry policy spotipy builds for its own sessions, minus 429: rate_limit.py handles those
+# for the whole process, so one Retry-After pauses every session instead of each retrying alone.
+# urllib3 retries any 429 carrying Retry-After unless told not to honour the header, so it isn't.
+SPOTIFY_RETRIES = 3
+SPOTIFY_BACKOFF_FACTOR = 0.3
+SPOTIFY_RETRY_STATUSES = (500, 502, 503, 504)
+
+
+def build_spotify_session():
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=SPOTIFY_RETRIES,
+        connect=None,
+        read=False,
+        allowed_methods=frozenset(["GET", "POST", "PUT", "DELETE"]),
+        status=SPOTIFY_RETRIES,
+        backoff_factor=SPOTIFY_BACKOFF_FACTOR,
+        status_forcelist=SPOTIFY_RETRY_STATUSES,
+        respect_retry_after_header=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=SPOTIFY_POOL_CONNECTIONS,
+        pool_maxsize=SPOTIFY_POOL_MAXSIZE,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def open_sqlite(path, schema, wal=False):
+    """Connection for a store shared across threads; the store serializes access with its own lock."""
+    import sqlite3
+
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    db = sqlite3.connect(path, check_same_thread=False)
+    if wal:
+        # Other processes on the host can read while one of them writes
+        db.execute("PRAGMA journal_mode=WAL")
+    db.executescript(schema)
+    return db
+
+
+class ClientRegistry:
+    """Process-wide home for clients that are expensive to build and safe to share."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = {}
+
+    def get(self, key, factory):
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = factory()
+            return self._clients[key]
+
+    def spotify_session(self):
+        return self.get("spotify_session", build_spotify_session)
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ClientRegistry()
+        return _registry
+
+
+def set_registry(registry):
+    # App.py installs a registry from st.cache_resource so every session of the server shares it
+    global _registry
+    with _registry_lock:
+        _registry = registry
@@ -0,0 +1,207 @@
+# genres.py
+
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from clients import get_registry, open_sqlite
+from logic import CACHE_DIR, MAX_PAGE_WORKERS, TRAITS
+from tracing import span
+
+# sp.artists() accepts at most 50 ids per request
+ARTISTS_PER_REQUEST = 50
+
+# Artist genres barely move; re-resolve them after a month
+GENRE_TTL = 30 * 24 * 3600
+
+LOCAL_TRAIT_COUNT = 6
+
+# Genre keyword -> trait affinities. A Spotify genre ("indie folk", "dark trap") picks up every
+# keyword that appears in it as a whole word or phrase ("trap" is not "rap", "broadway" not "road"),
+# so the table stays small while covering thousands of micro-genres.
+GENRE_TRAIT_AFFINITY = {
+    "pop": {"🌞 Happy-go-vibey": 1.0, "🕺 Party Starter": 0.5},
+    "dance": {"🕺 Party Starter": 1.0, "🌞 Happy-go-vibey": 0.5},
+    "edm": {"🕺 Party Starter": 1.0, "🎮 Digital Escapist": 0.4},
+    "house": {"🕺 Party Starter": 1.0, "🎮 Digital Escapist": 0.3},
+    "techno": {"🕺 Party Starter": 0.8, "🎮 Digital Escapist": 0.6, "🐺 Lone Wolf": 0.3},
+    "electro": {"🕺 Party Starter": 0.7, "🎮 Digital Escapist": 0.6},
+    "electronic": {"🕺 Party Starter": 0.7, "🎮 Digital Escapist": 0.6},
+    "electronica": {"🎮 Digital Escapist": 0.7, "🧘 Zen Seeker": 0.4},
+    "hip hop": {"🎯 Determined Hustler": 1.0, "💪 Motivated Maverick": 0.7},
+    "rap": {"🎯 Determined Hustler": 1.0, "💪 Motivated Maverick": 0.6},
+    "trap": {"🎯 Determined Hustler": 0.8, "🕺 Party Starter": 0.5},
+    "drill": {"🎯 Determined Hustler": 0.8, "🐺 Lone Wolf": 0.6},
+    "r&b": {"💔 Old-School Romantic": 1.0, "🔥 Passion Pusher": 0.5},
+    "soul": {"💔 Old-School Romantic": 0.9, "🧠 Deep Diver": 0.4},
+    "rock": {"🔥 Passion Pusher": 0.7, "🚗 Roadtrip Junkie": 0.8},
+    "metal": {"🔥 Passion Pusher": 1.0, "🐺 Lone Wolf": 0.6},
+    "metalcore": {"🔥 Passion Pusher": 1.0, "🐺 Lone Wolf": 0.5},
+    "punk": {"🔥 Passion Pusher": 0.9, "🐺 Lone Wolf": 0.5},
+    "hardcore": {"🔥 Passion Pusher": 1.0, "🐺 Lone Wolf": 0.4},
+    "indie": {"🎨 ArtSoul Explorer": 1.0, "🫥 Melancholic Thinker": 0.4},
+    "alternative": {"🎨 ArtSoul Explorer": 0.8, "🐺 Lone Wolf": 0.4},
+    "emo": {"🫥 Melancholic Thinker": 1.0, "💃 Drama Enthusiast": 0.4},
+    "sad": {"🫥 Melancholic Thinker": 1.0},
+    "slowcore": {"🫥 Melancholic Thinker": 1.0, "🧠 Deep Diver": 0.4},
+    "folk": {"🏞️ Nature Chiller": 0.8, "🧠 Deep Diver": 0.5, "🫥 Melancholic Thinker": 0.3},
+    "acoustic": {"🏞️ Nature Chiller": 0.8, "🧘 Zen Seeker": 0.4},
+    "singer-songwriter": {"🧠 Deep Diver": 0.8, "🫥 Melancholic Thinker": 0.5},
+    "country": {"🚗 Roadtrip Junkie": 1.0, "💔 Old-School Romantic": 0.5},
+    "jazz": {"🧠 Deep Diver": 0.8, "💔 Old-School Romantic": 0.5},
+    "blues": {"🧠 Deep Diver": 0.6, "🫥 Melancholic Thinker": 0.6},
+    "classical": {"🧠 Deep Diver": 0.8, "🧘 Zen Seeker": 0.4},
+    "soundtrack": {"🐉 Fantasy Head": 0.8, "💃 Drama Enthusiast": 0.5},
+    "ambient": {"🧘 Zen Seeker": 1.0, "🧃 Chillwave Surfer": 0.4},
+    "lo-fi": {"🧘 Zen Seeker": 0.8, "🧃 Chillwave Surfer": 0.8},
+    "chill": {"🧘 Zen Seeker": 0.7, "🧃 Chillwave Surfer": 0.8},
+    "new age": {"🧘 Zen Seeker": 1.0, "🏞️ Nature Chiller": 0.5},
+    "latin": {"✈️ Wanderlust Dreamer": 0.8, "🕺 Party Starter": 0.6},
+    "reggaeton": {"🕺 Party Starter": 0.9, "✈️ Wanderlust Dreamer": 0.5},
+    "afro": {"✈️ Wanderlust Dreamer": 0.8, "🕺 Party Starter": 0.6},
+    "afrobeats": {"✈️ Wanderlust Dreamer": 0.8, "🕺 Party Starter": 0.8},
+    "k-pop": {"✈️ Wanderlust Dreamer": 0.6, "💃 Drama Enthusiast": 0.6},
+    "bollywood": {"✈️ Wanderlust Dreamer": 0.5, "💃 Drama Enthusiast": 0.8},
+    "reggae": {"🧘 Zen Seeker": 0.6, "✈️ Wanderlust Dreamer": 0.6},
+    "world": {"✈️ Wanderlust Dreamer": 1.0},
+    "disco": {"🪩 Retro Rider": 1.0, "🕺 Party Starter": 0.5},
+    "funk": {"🪩 Retro Rider": 0.8, "🕺 Party Starter": 0.5},
+    "synthwave": {"🪩 Retro Rider": 1.0, "🎮 Digital Escapist": 0.5},
+    "oldies": {"🪩 Retro Rider": 1.0, "💔 Old-School Romantic": 0.5},
+    "80s": {"🪩 Retro Rider": 1.0},
+    "70s": {"🪩 Retro Rider": 1.0},
+    "chillwave": {"🧃 Chillwave Surfer": 1.0},
+    "vaporwave": {"🧃 Chillwave Surfer": 0.8, "🎮 Digital Escapist": 0.6},
+    "video game": {"🎮 Digital Escapist": 1.0, "🐉 Fantasy Head": 0.4},
+    "chiptune": {"🎮 Digital Escapist": 1.0},
+    "anime": {"🎮 Digital Escapist": 0.8, "🐉 Fantasy Head": 0.7},
+    "vocaloid": {"🎮 Digital Escapist": 1.0},
+    "fantasy": {"🐉 Fantasy Head": 1.0},
+    "epic": {"🐉 Fantasy Head": 0.8, "💪 Motivated Maverick": 0.4},
+    "show tunes": {"💃 Drama Enthusiast": 1.0},
+    "broadway": {"💃 Drama Enthusiast": 1.0},
+    "gospel": {"💪 Motivated Maverick": 0.7, "🧘 Zen Seeker": 0.4},
+    "workout": {"💪 Motivated Maverick": 1.0},
+    "ballad": {"💔 Old-School Romantic": 0.9, "💃 Drama Enthusiast": 0.4},
+    "road": {"🚗 Roadtrip Junkie": 1.0},
+}
+GENRE_KEYWORDS = tuple(GENRE_TRAIT_AFFINITY)
+KEYWORD_PATTERNS = tuple(re.compile(rf"\b{re.escape(keyword)}\b") for keyword in GENRE_KEYWORDS)
+
+
+def affinity_matrix():
+    import numpy as np
+
+    matrix = np.zeros((len(GENRE_KEYWORDS), len(TRAITS)))
+    for row, keyword in enumerate(GENRE_KEYWORDS):
+        for trait, weight in GENRE_TRAIT_AFFINITY[keyword].items():
+            matrix[row, TRAITS.index(trait)] = weight
+    return matrix
+
+
+class ArtistGenreCache:
+    """Artist id -> genres, shared by all users: in memory, backed by SQLite."""
+
+    def __init__(self, path=os.path.join(CACHE_DIR, "artists.sqlite3"), ttl=GENRE_TTL):
+        self.ttl = ttl
+        self._memory = {}
+        self._lock = threading.Lock()
+        self._db = open_sqlite(
+            path, "CREATE TABLE IF NOT EXISTS artist_genres (artist_id TEXT PRIMARY KEY, genres TEXT NOT NULL, fetched_at REAL NOT NULL)"
+        )
+
+    def get_many(self, artist_ids):
+        found, missing = {}, []
+        fresh_after = time.time() - self.ttl
+        with self._lock:
+            for artist_id in artist_ids:
+                if artist_id in self._memory:
+                    found[artist_id] = self._memory[artist_id]
+                else:
+                    missing.append(artist_id)
+            for start in range(0, len(missing), 500):
+                chunk = missing[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT artist_id, genres FROM artist_genres WHERE fetched_at > ? AND artist_id IN ({','.join('?' * len(chunk))})",
+                    (fresh_after, *chunk),
+                ).fetchall()
+                for artist_id, genres in rows:
+                    found[artist_id] = self._memory[artist_id] = json.loads(genres)
+        return found
+
+    def put_many(self, genres_by_artist):
+        now = time.time()
+        with self._lock, self._db:
+            self._memory.update(genres_by_artist)
+            self._db.executemany(
+                "INSERT OR REPLACE INTO artist_genres VALUES (?, ?, ?)",
+                [(artist_id, json.dumps(genres), now) for artist_id, genres in genres_by_artist.items()],
+            )
+
+
+def get_genre_cache():
+    return get_registry().get("artist_genres", ArtistGenreCache)
+
+
+def resolve_artist_genres(sp, artist_ids, cache=None):
+    cache = cache or get_genre_cache()
+    artist_ids = list(dict.fromkeys(artist_id for artist_id in artist_ids if artist_id))
+    with span("genres.resolve", artists=len(artist_ids)) as resolve_span:
+        genres = cache.get_many(artist_ids)
+        missing = [artist_id for artist_id in artist_ids if artist_id not in genres]
+        batches = [missing[i:i + ARTISTS_PER_REQUEST] for i in range(0, len(missing), ARTISTS_PER_REQUEST)]
+        resolve_span.set(cache_hits=len(genres), cache_misses=len(missing), requests=len(batches))
+        if batches:
+            with ThreadPoolExecutor(max_workers=MAX_PAGE_WORKERS) as pool:
+                for response in pool.map(sp.artists, batches):
+                    fetched = {artist["id"]: artist.get("genres", []) for artist in response["artists"] if artist}
+                    cache.put_many(fetched)
+                    genres.update(fetched)
+    return genres
+
+
+def genre_weights(df, genres_by_artist):
+    """Total track weight per genre; a track's weight is split evenly across its artists."""
+    import pandas as pd
+
+    if "artist_ids" not in df or df.empty:
+        return pd.Series(dtype="float64")
+    artists = df[["weight", "artist_ids"]].explode("artist_ids").dropna()
+    artists["weight"] /= artists.groupby(level=0)["weight"].transform("size")
+    artists["genre"] = artists["artist_ids"].map(genres_by_artist)
+    genres = artists[["weight", "genre"]].explode("genre").dropna()
+    return genres.groupby("genre")["weight"].sum().sort_values(ascending=False)
+
+
+def genre_summary(weights, limit=15):
+    return ", ".join(f"{genre} ({weight:.1f})" for genre, weight in weights.head(limit).items())
+
+
+def score_traits(weights):
+    """Weighted genres -> keyword weights -> trait scores via one multiply with the affinity matrix."""
+    import numpy as np
+
+    membership = np.array(
+        [[pattern.search(genre) is not None for pattern in KEYWORD_PATTERNS] for genre in weights.index], dtype="float64"
+    ).reshape(len(weights), len(GENRE_KEYWORDS))
+    keyword_weights = weights.to_numpy() @ membership
+    return keyword_weights @ affinity_matrix()
+
+
+def local_trait_summary(weights, count=LOCAL_TRAIT_COUNT):
+    """Trait breakdown in the same format Gemini is asked for, or None without genre signal."""
+    import numpy as np
+
+    scores = score_traits(weights)
+    top = [i for i in np.argsort(-scores, kind="stable")[:count] if scores[i] > 0]
+    if not top:
+        return None
+    shares = scores[top] / scores[top].sum() * 100
+    # Largest remainder rounding so the percentages add up to exactly 100
+    percents = np.floor(shares).astype(int)
+    for i in np.argsort(-(shares - percents), kind="stable")[:100 - percents.sum()]:
+        percents[i] += 1
+    return "\n".join(f"🎧 {TRAITS[i]}: {percent}%" for i, percent in zip(top, percents))
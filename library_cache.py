@@ -0,0 +1,232 @@
+# library_cache.py
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
+
+from clients import get_registry, open_sqlite
+from logic import (
+    CACHE_DIR,
+    PAGE_SIZE,
+    SOURCE_LIMITS,
+    SOURCE_WEIGHTS,
+    SOURCES,
+    TrackColumns,
+    iter_spotify_pages,
+    spotify_user_id,
+    tracks_frame,
+)
+from tracing import span, submit
+
+LIBRARY_DB = os.path.join(CACHE_DIR, "library.sqlite3")
+
+# Seconds a stored source is served as-is before we ask Spotify what changed
+SOURCE_TTLS = {"top": 24 * 3600, "liked": 3600, "recent": 300}
+
+# Incremental sync can't see removed likes, so saved tracks get a full crawl once in a while
+LIKED_FULL_RESYNC = 7 * 24 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    user_id TEXT NOT NULL,
+    source TEXT NOT NULL,
+    item_key TEXT NOT NULL,
+    stamp TEXT NOT NULL,
+    track_id TEXT,
+    track_name TEXT,
+    artists TEXT,
+    artist_ids TEXT,
+    PRIMARY KEY (user_id, source, item_key)
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    user_id TEXT NOT NULL,
+    source TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    full_sync_at REAL NOT NULL,
+    cursor TEXT,
+    PRIMARY KEY (user_id, source)
+);
+"""
+
+
+class SourcePages:
+    """One source's pages as TrackColumns, plus the item keys and stamps the store orders them by."""
+
+    def __init__(self, source, capacity):
+        self.source = source
+        self.columns = TrackColumns(capacity)
+        self.keys, self.stamps = [], []
+
+    def append(self, items):
+        start = self.columns.size
+        self.columns.append_page(items, self.source)
+        if self.source == "liked":
+            # A track can only be liked once; its added_at orders the library newest-first
+            self.keys += [item["track"]["id"] or f"local:{start + i}" for i, item in enumerate(items)]
+            self.stamps += [item["added_at"] for item in items]
+        elif self.source == "recent":
+            self.keys += [item["played_at"] for item in items]
+            self.stamps += self.keys[start:]
+        else:
+            # Top tracks come ranked; zero-padded rank keeps that order under string sort
+            self.keys += [f"{position:06d}" for position in range(start, start + len(items))]
+            self.stamps += self.keys[start:]
+
+    def rows(self, user_id):
+        columns, n = self.columns, self.columns.size
+        return zip(
+            repeat(user_id, n), repeat(self.source, n), self.keys, self.stamps,
+            columns.track_ids[:n], columns.track_names[:n], columns.artists[:n],
+            map(json.dumps, columns.artist_ids[:n]),
+        )
+
+
+class LibraryStore:
+    """Per-user SQLite copy of a Spotify library, refreshed incrementally per source."""
+
+    def __init__(self, path=LIBRARY_DB, ttls=None):
+        self.path = path
+        self.ttls = {**SOURCE_TTLS, **(ttls or {})}
+        self._lock = threading.Lock()
+        self._db = open_sqlite(path, SCHEMA)
+
+    def sync_state(self, user_id, source):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT fetched_at, full_sync_at, cursor FROM sync_state WHERE user_id = ? AND source = ?",
+                (user_id, source),
+            ).fetchone()
+        return None if row is None else {"fetched_at": row[0], "full_sync_at": row[1], "cursor": row[2]}
+
+    def newest_stamp(self, user_id, source):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT MAX(stamp) FROM tracks WHERE user_id = ? AND source = ?", (user_id, source)
+            ).fetchone()
+        return row[0]
+
+    def write(self, user_id, source, pages, keep, replace=False, cursor=None, full_sync=False):
+        now = time.time()
+        with self._lock, self._db:
+            if replace:
+                self._db.execute("DELETE FROM tracks WHERE user_id = ? AND source = ?", (user_id, source))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?, ?)", pages.rows(user_id)
+            )
+            # Only the newest `keep` rows of a source are kept, matching what a fresh crawl would return
+            order = "ASC" if source == "top" else "DESC"
+            self._db.execute(
+                f"""DELETE FROM tracks WHERE user_id = ? AND source = ? AND item_key NOT IN (
+                    SELECT item_key FROM tracks WHERE user_id = ? AND source = ? ORDER BY stamp {order} LIMIT ?)""",
+                (user_id, source, user_id, source, keep),
+            )
+            previous = self._db.execute(
+                "SELECT full_sync_at, cursor FROM sync_state WHERE user_id = ? AND source = ?", (user_id, source)
+            ).fetchone()
+            full_sync_at = now if full_sync or previous is None else previous[0]
+            if cursor is None and previous is not None:
+                cursor = previous[1]
+            self._db.execute(
+                "INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?, ?, ?)",
+                (user_id, source, now, full_sync_at, cursor),
+            )
+
+    def load_frame(self, user_id):
+        import numpy as np
+        import pandas as pd
+
+        with self._lock:
+            stored = pd.read_sql_query(
+                "SELECT source, track_id, track_name, artists, artist_ids FROM tracks WHERE user_id = ?",
+                self._db, params=(user_id,),
+            )
+        codes = pd.Categorical(stored["source"], categories=SOURCES).codes
+        return tracks_frame(
+            stored["track_id"],
+            stored["track_name"],
+            stored["artists"],
+            # Every row's JSON list decoded in one call
+            json.loads("[" + ",".join(stored["artist_ids"]) + "]"),
+            np.array([SOURCE_WEIGHTS[source] for source in SOURCES])[codes],
+            codes,
+        )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def _full_crawl(sp, store, user_id, source, limit):
+    pages = SourcePages(source, limit)
+    for _, items in iter_spotify_pages(sp, {source: limit}, sources=(source,)):
+        pages.append(items)
+    store.write(user_id, source, pages, keep=limit, replace=True, full_sync=True)
+
+
+def _refresh_liked(sp, store, user_id, limit):
+    # No stored likes yet (an empty library at the last crawl): every saved track is new
+    newest = store.newest_stamp(user_id, "liked") or ""
+    pages, offset = SourcePages("liked", PAGE_SIZE), 0
+    # Saved tracks come newest first, so stop at the first page that reaches what we already have
+    while offset < limit:
+        page = sp.current_user_saved_tracks(limit=min(PAGE_SIZE, limit - offset), offset=offset)
+        fresh = [item for item in page["items"] if item["added_at"] > newest]
+        pages.append(fresh)
+        if len(fresh) < len(page["items"]) or not page.get("next"):
+            break
+        offset += PAGE_SIZE
+    store.write(user_id, "liked", pages, keep=limit)
+
+
+def _refresh_recent(sp, store, user_id, limit, cursor):
+    page = sp.current_user_recently_played(limit=min(PAGE_SIZE, limit), after=cursor)
+    pages = SourcePages("recent", PAGE_SIZE)
+    pages.append(page["items"])
+    cursor = (page.get("cursors") or {}).get("after") or cursor
+    store.write(user_id, "recent", pages, keep=limit, cursor=cursor)
+
+
+def refresh_source(sp, store, user_id, source, limit):
+    with span("library.refresh", source=source) as refresh_span:
+        mode = _refresh_source(sp, store, user_id, source, limit)
+        refresh_span.set(mode=mode, cache_hit=mode == "fresh")
+        return mode
+
+
+def _refresh_source(sp, store, user_id, source, limit):
+    state = store.sync_state(user_id, source)
+    now = time.time()
+    if state is not None and now - state["fetched_at"] < store.ttls[source]:
+        return "fresh"
+    if state is None or source == "top" or (source == "liked" and now - state["full_sync_at"] > LIKED_FULL_RESYNC):
+        _full_crawl(sp, store, user_id, source, limit)
+        return "full"
+    if source == "liked":
+        _refresh_liked(sp, store, user_id, limit)
+    else:
+        _refresh_recent(sp, store, user_id, limit, state["cursor"])
+    return "incremental"
+
+
+def get_library_store():
+    return get_registry().get("library_store", LibraryStore)
+
+
+def fetch_cached_spotify_data(sp, store=None, limits=None):
+    """Drop-in for fetch_all_spotify_data that only pulls what changed since the last visit."""
+    store = store or get_library_store()
+    limits = {**SOURCE_LIMITS, **(limits or {})}
+    with span("library.sync") as sync_span:
+        # The first API call of a session also pays for the OAuth token exchange
+        with span("spotify.auth"):
+            user_id = spotify_user_id(sp)
+        with ThreadPoolExecutor(max_workers=len(SOURCES)) as pool:
+            refreshes = [submit(pool, refresh_source, sp, store, user_id, source, limits[source]) for source in SOURCES]
+            modes = [refresh.result() for refresh in refreshes]
+        with span("library.load"):
+            df = store.load_frame(user_id)
+        sync_span.set(tracks=len(df), **dict(zip(SOURCES, modes)))
+        return df
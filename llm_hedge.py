@@ -0,0 +1,213 @@
+# llm_hedge.py
+#
+# Every Gemini call goes through a HedgedCaller: it gets a deadline, a duplicate request once it has
+# taken longer than most calls of its kind (a percentile of the latencies seen so far), and a cheaper
+# fallback (smaller prompt, lighter model or a locally computed answer) when the deadline passes.
+# mirror_llm_calls_total{call, path} counts which of primary, hedge and fallback answered.
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from clients import get_registry
+from tracing import METRICS, annotate, submit
+
+# Seconds a call may take before its fallback answers instead; chat counts to the first token
+LLM_DEADLINES = {
+    "traits": 25.0, "traits.fallback": 10.0, "chat": 8.0, "chat.fallback": 8.0, "chat.sample": 20.0, "chat.summary": 20.0,
+}
+DEFAULT_LLM_DEADLINE = 20.0
+
+# The duplicate goes out once the call is slower than this percentile of recent calls
+HEDGE_PERCENTILE = float(os.environ.get("MIRROR_HEDGE_PERCENTILE", "95"))
+# Recent successful latencies kept per call kind, and how many are needed before trusting them;
+# until then the duplicate goes out halfway to the deadline
+HEDGE_WINDOW = 500
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = 0.05
+# At most this share of calls may send a duplicate, so a slow backend isn't sent twice the load
+HEDGE_BUDGET = 0.1
+
+# LLM requests in flight at once across all sessions, abandoned ones included
+LLM_WORKERS = 32
+
+
+class LatencyTracker:
+    """Rolling window of call latencies with percentile lookups."""
+
+    def __init__(self, window=HEDGE_WINDOW):
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def __len__(self):
+        return len(self._latencies)
+
+    def percentile(self, p):
+        with self._lock:
+            ordered = sorted(self._latencies)
+        if not ordered:
+            return None
+        return ordered[min(int(len(ordered) * p / 100), len(ordered) - 1)]
+
+
+class HedgedCaller:
+    """Deadline, hedged duplicate and fallback for one kind of LLM call."""
+
+    def __init__(self, name, deadline=None, percentile=HEDGE_PERCENTILE, budget=HEDGE_BUDGET, executor=None):
+        self.name = name
+        self.deadline = deadline or LLM_DEADLINES.get(name, DEFAULT_LLM_DEADLINE)
+        self.percentile = percentile
+        self.budget = budget
+        self.latencies = LatencyTracker()
+        self._executor = executor
+        self._calls = self._hedges = 0
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = get_llm_executor()
+        return self._executor
+
+    def hedge_delay(self):
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return self.deadline / 2
+        return max(self.latencies.percentile(self.percentile), HEDGE_MIN_DELAY)
+
+    def _may_hedge(self):
+        with self._lock:
+            if self._hedges + 1 > self.budget * self._calls + 1:
+                return False
+            self._hedges += 1
+            return True
+
+    def _timed(self, attempt):
+        started = time.monotonic()
+        result = attempt()
+        self.latencies.add(time.monotonic() - started)
+        return result
+
+    def call(self, attempt, fallback=None, discard=None):
+        """Run `attempt()` under the deadline; returns (result, path).
+
+        `fallback()` answers when the deadline passes or every attempt failed; without one the
+        last error, or TimeoutError, is raised. `discard(result)` releases a losing attempt's result.
+        """
+        started = time.monotonic()
+        deadline = started + self.deadline
+        hedge_at = started + self.hedge_delay()
+        with self._lock:
+            self._calls += 1
+        paths = {submit(self.executor, self._timed, attempt): "primary"}
+        pending, hedged, error = set(paths), False, None
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            wake_at = deadline if hedged else min(hedge_at, deadline)
+            done, pending = wait(pending, timeout=max(wake_at - now, 0), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    self._abandon(pending, discard)
+                    return future.result(), self._won(paths[future], started)
+                error = future.exception()
+            # A failed primary is retried right away; a slow one is duplicated at the hedge delay
+            if not hedged and (not pending or time.monotonic() >= hedge_at) and time.monotonic() < deadline:
+                hedged = True
+                if self._may_hedge():
+                    METRICS.inc("mirror_llm_hedges_total", call=self.name)
+                    hedge = submit(self.executor, self._timed, attempt)
+                    paths[hedge] = "hedge"
+                    pending.add(hedge)
+        self._abandon(pending, discard)
+        if fallback is None:
+            METRICS.inc("mirror_llm_calls_total", call=self.name, path="error" if error and not pending else "timeout")
+            if error is not None and not pending:
+                raise error
+            raise TimeoutError(f"{self.name} LLM call missed its {self.deadline:.0f}s deadline")
+        annotate(llm_error=type(error).__name__ if error is not None and not pending else "deadline")
+        return fallback(), self._won("fallback", started)
+
+    def _won(self, path, started):
+        METRICS.inc("mirror_llm_calls_total", call=self.name, path=path)
+        METRICS.observe("mirror_llm_call_seconds", time.monotonic() - started, call=self.name, path=path)
+        annotate(llm_path=path)
+        return path
+
+    @staticmethod
+    def _abandon(futures, discard):
+        # Requests already sent can't be recalled; they finish in the background (bounded by the
+        # client timeout) and whatever they return is released
+        for future in futures:
+            if not future.cancel() and discard is not None:
+                future.add_done_callback(lambda f: f.exception() is None and discard(f.result()))
+
+
+def get_llm_executor():
+    return get_registry().get(
+        "llm_executor",
+        lambda: ThreadPoolExecutor(max_workers=LLM_WORKERS, thread_name_prefix="llm"),
+    )
+
+
+def get_hedger(name):
+    return get_registry().get(("llm_hedger", name), lambda: HedgedCaller(name))
+
+
+def hedged_call(name, attempt, fallback=None):
+    """`attempt()` under the `name` call kind's deadline and hedging; returns (result, path)."""
+    return get_hedger(name).call(attempt, fallback)
+
+
+def _first_chunk(make_stream):
+    stream = iter(make_stream())
+    for chunk in stream:
+        return chunk, stream
+    return None, stream
+
+
+def _close_stream(started):
+    close = getattr(started[1], "close", None)
+    if close is not None:
+        close()
+
+
+def hedged_stream(name, make_stream, fallback=None, unavailable=None):
+    """Stream whose first chunk is hedged and deadline-bounded; returns (chunks, path).
+
+    `make_stream()` and `fallback()` each return an iterator of chunks; the fallback gets its own
+    deadline as the "<name>.fallback" call, past which the stream is the single chunk `unavailable`
+    (path "unavailable"), or TimeoutError without one. The winner's remaining chunks are read on the
+    caller's thread; losing streams are closed.
+    """
+    fallback_path = None
+
+    def bounded_fallback():
+        nonlocal fallback_path
+        started, fallback_path = get_hedger(f"{name}.fallback").call(
+            lambda: _first_chunk(fallback),
+            None if unavailable is None else (lambda: (unavailable, iter(()))),
+            discard=_close_stream,
+        )
+        return started
+
+    (first, rest), path = get_hedger(name).call(
+        lambda: _first_chunk(make_stream),
+        fallback and bounded_fallback,
+        discard=_close_stream,
+    )
+    if fallback_path == "fallback":
+        path = "unavailable"
+
+    def chunks():
+        if first is not None:
+            yield first
+            yield from rest
+
+    return chunks(), path
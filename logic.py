@@ -1,14 +1,20 @@
 # logic.py
 
+import hashlib
 import os
-import pandas as pd
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import ConversationChain
-from langchain_core.messages import SystemMessage
-from langchain_google_genai import ChatGoogleGenerativeAI
+import re
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dotenv import load_dotenv
+from analysis_cache import AnalysisCache
+from clients import get_registry
+from llm_hedge import LLM_DEADLINES, hedged_call, hedged_stream
+from rate_limit import BACKGROUND, ScheduledSpotify
+from tracing import METRICS, span, submit
+
+# pandas/numpy, spotipy, Gemini and LangChain are imported inside the functions that use them,
+# so the landing page renders without paying for any of them (see benchmarks/bench_startup.py)
 
 # ✅ Load credentials from .env file
 load_dotenv()
@@ -20,49 +26,339 @@ GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
 
 scope = "user-top-read user-library-read user-read-recently-played"
 
-def connect_spotify():
-    return spotipy.Spotify(auth_manager=SpotifyOAuth(
-        client_id=SPOTIPY_CLIENT_ID,
-        client_secret=SPOTIPY_CLIENT_SECRET,
-        redirect_uri=SPOTIPY_REDIRECT_URI,
-        scope=scope
-    ))
-
-def extract_track_info(tracks, source, weight, wrap_in_track_key=False):
-    return [
-        {
-            "track_id": item["track"]["id"] if wrap_in_track_key else item["id"],
-            "track_name": item["track"]["name"] if wrap_in_track_key else item["name"],
-            "artists": ", ".join(artist["name"] for artist in (item["track"]["artists"] if wrap_in_track_key else item["artists"])),
-            "weight": weight,
-            "source": source
-        } for item in tracks
-    ]
-
-
-def fetch_all_spotify_data(sp):
-    all_data = []
-    all_data += extract_track_info(sp.current_user_top_tracks(limit=50)["items"], "top", 1.0, wrap_in_track_key=False)
-    all_data += extract_track_info(sp.current_user_saved_tracks(limit=50)["items"], "liked", 0.8, wrap_in_track_key=True)
-    all_data += extract_track_info(sp.current_user_recently_played(limit=50)["items"], "recent", 0.7, wrap_in_track_key=True)
-    return pd.DataFrame(all_data)
+CACHE_DIR = os.environ.get("MIRROR_CACHE_DIR", ".mirror_cache")
+
+TRAIT_MODEL = "gemini-2.0-flash"
+TRAIT_TEMPERATURE = 0.6
+# Lighter model answering, with a smaller prompt, when the main one misses its deadline
+FALLBACK_MODEL = os.environ.get("MIRROR_FALLBACK_MODEL", "gemini-2.0-flash-lite")
+# Chat reply when neither model has started answering by their deadlines
+CHAT_UNAVAILABLE_REPLY = "My signal's a little fuzzy right now. Ask me that again in a moment?"
+# Per-request client timeout and retries; the deadlines in llm_hedge.py are what the user waits on,
+# these only bound how long an abandoned request keeps a worker
+LLM_REQUEST_TIMEOUT = 60
+LLM_MAX_RETRIES = 2
+# Bump whenever the wording of build_music_prompt changes so cached analyses are not reused
+PROMPT_TEMPLATE_VERSION = "2"
+
+def connect_spotify(session_key=None):
+    import spotipy
+    from spotipy.oauth2 import SpotifyOAuth
+    from token_cache import SessionTokenHandler, get_token_refresher
+
+    # OAuth state is per user, but the pooled keep-alive HTTP session is shared by everyone,
+    # and every API call queues in the process-wide scheduler (see rate_limit.py)
+    # Tokens are kept in memory per session (see token_cache.py) and refreshed ahead of expiry;
+    # a caller without a session gets a token of its own rather than a shared one
+    session_key = session_key or uuid.uuid4().hex
+    with span("spotify.connect"):
+        session = get_registry().spotify_session()
+        auth_manager = SpotifyOAuth(
+            client_id=SPOTIPY_CLIENT_ID,
+            client_secret=SPOTIPY_CLIENT_SECRET,
+            redirect_uri=SPOTIPY_REDIRECT_URI,
+            scope=scope,
+            cache_handler=SessionTokenHandler(session_key),
+            requests_session=session
+        )
+        get_token_refresher().start()
+        return ScheduledSpotify(spotipy.Spotify(auth_manager=auth_manager, requests_session=session))
+
+
+def spotify_user_id(sp):
+    # Asked once per client and remembered on it; the library and profile stores both key on it
+    if getattr(sp, "user_id", None) is None:
+        sp.user_id = sp.current_user()["id"]
+    return sp.user_id
+
+
+def get_chat_model(model=TRAIT_MODEL, temperature=TRAIT_TEMPERATURE):
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    return get_registry().get(
+        ("chat_model", model, temperature),
+        lambda: ChatGoogleGenerativeAI(
+            model=model,
+            google_api_key=GEMINI_API_KEY,
+            temperature=temperature,
+            timeout=LLM_REQUEST_TIMEOUT,
+            max_retries=LLM_MAX_RETRIES,
+        ),
+    )
+
+# Spotify caps every page at 50 items; several pages are requested at once
+PAGE_SIZE = 50
+MAX_PAGE_WORKERS = 6
+
+# Per-source cap on how many tracks we pull (recently played only ever returns the last 50)
+SOURCE_LIMITS = {"top": 200, "liked": 2000, "recent": 50}
+
+# Source order doubles as the categorical code of the "source" column
+SOURCES = ("top", "liked", "recent")
+SOURCE_WEIGHTS = {"top": 1.0, "liked": 0.8, "recent": 0.7}
+WRAPPED_SOURCES = {"liked", "recent"}
+PAGINATED_SOURCES = {"top", "liked"}
+
+
+class TrackColumns:
+    """Preallocated column buffers that Spotify pages are appended into."""
+
+    def __init__(self, capacity):
+        import numpy as np
+
+        self.size = 0
+        self.track_ids = [None] * capacity
+        self.track_names = [None] * capacity
+        self.artists = [None] * capacity
+        self.artist_ids = [None] * capacity
+        self.weights = np.empty(capacity, dtype="float64")
+        self.source_codes = np.empty(capacity, dtype="int8")
+
+    def _grow(self, needed):
+        import numpy as np
+
+        extra = max(needed, len(self.track_ids))
+        for name in ("track_ids", "track_names", "artists", "artist_ids"):
+            getattr(self, name).extend([None] * extra)
+        self.weights = np.concatenate([self.weights, np.empty(extra, dtype="float64")])
+        self.source_codes = np.concatenate([self.source_codes, np.empty(extra, dtype="int8")])
+
+    def append_page(self, items, source):
+        start, end = self.size, self.size + len(items)
+        if end > len(self.track_ids):
+            self._grow(end - len(self.track_ids))
+        if source in WRAPPED_SOURCES:
+            items = [item["track"] for item in items]
+        for i, track in enumerate(items, start):
+            artists = track["artists"]
+            self.track_ids[i] = track["id"]
+            self.track_names[i] = track["name"]
+            self.artists[i] = ", ".join(artist["name"] for artist in artists)
+            self.artist_ids[i] = [artist["id"] for artist in artists]
+        self.weights[start:end] = SOURCE_WEIGHTS[source]
+        self.source_codes[start:end] = SOURCES.index(source)
+        self.size = end
+
+    def to_frame(self):
+        n = self.size
+        return tracks_frame(
+            self.track_ids[:n], self.track_names[:n], self.artists[:n],
+            self.artist_ids[:n], self.weights[:n], self.source_codes[:n],
+        )
+
+
+def tracks_frame(track_ids, track_names, artists, artist_ids, weights, source_codes):
+    import pandas as pd
+
+    return pd.DataFrame({
+        "track_id": track_ids,
+        "track_name": track_names,
+        "artists": artists,
+        "artist_ids": artist_ids,
+        "weight": weights,
+        "source": pd.Categorical.from_codes(source_codes, categories=SOURCES),
+    }, copy=False)
+
+
+def _page_fetchers(sp):
+    return {
+        "top": sp.current_user_top_tracks,
+        "liked": sp.current_user_saved_tracks,
+        "recent": lambda limit, offset: sp.current_user_recently_played(limit=limit),
+    }
+
+
+def iter_spotify_pages(sp, limits=None, sources=SOURCES):
+    """Yield (source, items) for every page as soon as it arrives, in completion order."""
+    limits = {**SOURCE_LIMITS, **(limits or {})}
+    fetchers = _page_fetchers(sp)
+    with ThreadPoolExecutor(max_workers=MAX_PAGE_WORKERS) as pool:
+        requests = {
+            pool.submit(fetchers[source], limit=min(PAGE_SIZE, limits[source]), offset=0): (source, 0)
+            for source in sources
+        }
+        pending = set(requests)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                source, offset = requests.pop(future)
+                page = future.result()
+                items = page["items"]
+                # The first page tells us how many more pages to put in flight
+                if offset == 0 and source in PAGINATED_SOURCES and page.get("next"):
+                    total = min(page.get("total") or len(items), limits[source])
+                    for next_offset in range(len(items), total, PAGE_SIZE):
+                        next_page = pool.submit(fetchers[source], limit=min(PAGE_SIZE, total - next_offset), offset=next_offset)
+                        requests[next_page] = (source, next_offset)
+                        pending.add(next_page)
+                yield source, items[:limits[source] - offset]
+
+
+def fetch_all_spotify_data(sp, limits=None):
+    limits = {**SOURCE_LIMITS, **(limits or {})}
+    with span("spotify.fetch") as fetch_span:
+        columns = TrackColumns(sum(limits[source] for source in SOURCES))
+        started = time.perf_counter()
+        for source, items in iter_spotify_pages(sp, limits):
+            columns.append_page(items, source)
+            # Sources are fetched side by side; each one's time is until its last page arrived
+            fetch_span.attributes[f"{source}_pages"] = fetch_span.attributes.get(f"{source}_pages", 0) + 1
+            fetch_span.attributes[f"{source}_items"] = fetch_span.attributes.get(f"{source}_items", 0) + len(items)
+            fetch_span.attributes[f"{source}_seconds"] = time.perf_counter() - started
+        fetch_span.set(tracks=columns.size)
+        return columns.to_frame()
+
+# Label for every combination of source bits, indexed by bitmask (bit i = SOURCES[i])
+SOURCE_LABELS = tuple(
+    ", ".join(sorted(source for i, source in enumerate(SOURCES) if mask & (1 << i)))
+    for mask in range(1 << len(SOURCES))
+)
+
+
+def source_codes(df):
+    import pandas as pd
+
+    source = df["source"]
+    if isinstance(source.dtype, pd.CategoricalDtype) and tuple(source.cat.categories) == SOURCES:
+        return source.cat.codes.to_numpy()
+    return pd.Categorical(source, categories=SOURCES).codes
+
 
 def deduplicate_and_weight(df):
-    df = df.groupby(['track_id', 'track_name', 'artists']).agg({
-        'weight': 'sum',
-        'source': lambda x: ', '.join(sorted(set(x)))
-    }).reset_index()
-    return df
-
-def build_music_prompt(df):
-    df = df.sort_values("weight", ascending=False)
-    song_entries = [
-        f'"{row.track_name}" by {row.artists} [Weight: {row.weight:.2f}, Source: {row.source}]'
-        for _, row in df.iterrows()
-    ]
-    song_list = "\n".join(f"- {entry}" for entry in song_entries)
-
-    personality_traits = """
+    with span("dedupe", rows_in=len(df)) as dedupe_span:
+        df = _deduplicate_and_weight(df)
+        dedupe_span.set(rows_out=len(df))
+        return df
+
+
+def _deduplicate_and_weight(df):
+    import numpy as np
+
+    codes = source_codes(df)
+    # One boolean column per source; "max" per group is a bitwise OR that stays in cython
+    flags = {source: codes == i for i, source in enumerate(SOURCES)}
+    # Artist ids ride along (when the frame has them) for genre enrichment
+    extra = {"artist_ids": ("artist_ids", "first")} if "artist_ids" in df else {}
+    columns = ["track_id", "track_name", "artists", "weight", *extra]
+    grouped = df[columns].assign(**flags).groupby("track_id", sort=True)
+    df = grouped.agg(
+        track_name=("track_name", "first"),
+        artists=("artists", "first"),
+        weight=("weight", "sum"),
+        **{source: (source, "max") for source in SOURCES},
+        **extra,
+    )
+    mask = np.zeros(len(df), dtype="int64")
+    for i, source in enumerate(SOURCES):
+        mask |= df.pop(source).to_numpy().astype("int64") << i
+    df["source"] = np.array(SOURCE_LABELS, dtype=object)[mask]
+    for column in extra:
+        df[column] = df.pop(column)
+    return df.reset_index()
+
+# The song list is the only part of the prompt that grows with the library, so it gets the budget
+PROMPT_TOP_K = 150
+PROMPT_TOKEN_BUDGET = 2500
+# Share of the budget kept for per-artist aggregates of the tracks that didn't make the cut
+PROMPT_TAIL_SHARE = 0.2
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def top_k_positions(weights, k):
+    import numpy as np
+
+    # argpartition finds the k heaviest in linear time; only those k get sorted
+    if len(weights) > k:
+        top = np.argpartition(-weights, k - 1)[:k]
+    else:
+        top = np.arange(len(weights))
+    return top[np.argsort(-weights[top], kind="stable")]
+
+
+def _within_budget(lines, budget):
+    import numpy as np
+
+    costs = (lines.str.len().to_numpy() + 1) // CHARS_PER_TOKEN + 1
+    return int(np.searchsorted(np.cumsum(costs), budget, side="right"))
+
+
+def format_song_lines(df):
+    import numpy as np
+    import pandas as pd
+
+    weights = pd.Series(np.char.mod("%.2f", df["weight"].to_numpy(dtype="float64")), index=df.index)
+    return (
+        '- "' + df["track_name"].astype(str) + '" by ' + df["artists"].astype(str)
+        + " [Weight: " + weights + ", Source: " + df["source"].astype(str) + "]"
+    )
+
+
+def format_artist_tail(df):
+    import numpy as np
+    import pandas as pd
+
+    tail = df.groupby("artists", sort=False)["weight"].agg(["size", "mean", "sum"])
+    tail = tail.sort_values("sum", ascending=False, kind="stable")
+    means = pd.Series(np.char.mod("%.2f", tail["mean"].to_numpy()), index=tail.index)
+    artists = tail.index.to_series(index=tail.index).astype(str)
+    return "- " + artists + " ×" + tail["size"].astype(str) + ", avg weight " + means
+
+
+def build_song_list(df, top_k=PROMPT_TOP_K, token_budget=PROMPT_TOKEN_BUDGET, collapse_tail=True):
+    import numpy as np
+
+    order = top_k_positions(df["weight"].to_numpy(dtype="float64"), top_k)
+    track_budget = token_budget * (1 - PROMPT_TAIL_SHARE) if collapse_tail else token_budget
+    lines = format_song_lines(df.iloc[order])
+    kept = _within_budget(lines, track_budget)
+    song_list = "\n".join(lines.iloc[:kept])
+
+    if collapse_tail and kept < len(df):
+        rest = np.ones(len(df), dtype=bool)
+        rest[order[:kept]] = False
+        tail = format_artist_tail(df.iloc[np.flatnonzero(rest)])
+        header = "\nOther artists in their library (tracks, average weight):\n"
+        tail = tail.iloc[:_within_budget(tail, token_budget - estimate_tokens(song_list + header))]
+        if len(tail):
+            song_list += header + "\n".join(tail)
+    return song_list
+
+
+# Trait groups offered to Gemini; genres.py scores the same traits locally
+TRAIT_TAXONOMY = {
+    "🎭 EMOTIONAL CORE": ("🌞 Happy-go-vibey", "💔 Old-School Romantic", "🫥 Melancholic Thinker", "🔥 Passion Pusher"),
+    "🚀 AMBITION & ENERGY": ("💪 Motivated Maverick", "🎯 Determined Hustler", "🧘 Zen Seeker", "🎨 ArtSoul Explorer"),
+    "🧑‍🤝‍🧑 SOCIAL STYLE": ("🕺 Party Starter", "🚗 Roadtrip Junkie", "🐺 Lone Wolf", "💃 Drama Enthusiast"),
+    "🌍 WORLDVIEW & LIFESTYLE": ("✈️ Wanderlust Dreamer", "🧠 Deep Diver", "🏞️ Nature Chiller", "🎮 Digital Escapist"),
+    "Optional (only if clearly supported by music):": ("🐉 Fantasy Head", "🪩 Retro Rider", "🧃 Chillwave Surfer"),
+}
+TRAITS = tuple(trait for traits in TRAIT_TAXONOMY.values() for trait in traits)
+TRAIT_MENU = "\n\n".join(f"{group}\n{', '.join(traits)}" for group, traits in TRAIT_TAXONOMY.items())
+
+# With genre aggregates in the prompt, far fewer raw track lines are needed
+PROMPT_TOP_K_WITH_GENRES = 60
+
+
+def build_music_prompt(df, top_k=PROMPT_TOP_K, token_budget=PROMPT_TOKEN_BUDGET, collapse_tail=True, genre_summary=None):
+    with span("prompt", tracks=len(df), genre_seeded=bool(genre_summary)) as prompt_span:
+        prompt, song_list = _build_music_prompt(df, top_k, token_budget, collapse_tail, genre_summary)
+        prompt_span.set(tokens=estimate_tokens(prompt), chars=len(prompt))
+        return prompt, song_list
+
+
+def _build_music_prompt(df, top_k, token_budget, collapse_tail, genre_summary):
+    if genre_summary:
+        top_k = min(top_k, PROMPT_TOP_K_WITH_GENRES)
+        token_budget -= estimate_tokens(genre_summary)
+    song_list = build_song_list(df, top_k, token_budget, collapse_tail)
+    if genre_summary:
+        song_list = f"Their most-played genres (total weight): {genre_summary}\n\n{song_list}"
+
+    personality_traits = f"""
 Analyze the user's personality based on the following list of songs.
 
 Each song entry includes:
@@ -76,20 +372,7 @@ Each song entry includes:
 
 Return only a **percentage breakdown** of the user’s most dominant personality traits (summing to 100%). Focus on **accuracy over coverage** (max 6 traits). Do not include extra text or analysis.
 
-🎭 EMOTIONAL CORE
-🌞 Happy-go-vibey, 💔 Old-School Romantic, 🫥 Melancholic Thinker, 🔥 Passion Pusher
-
-🚀 AMBITION & ENERGY
-💪 Motivated Maverick, 🎯 Determined Hustler, 🧘 Zen Seeker, 🎨 ArtSoul Explorer
-
-🧑‍🤝‍🧑 SOCIAL STYLE
-🕺 Party Starter, 🚗 Roadtrip Junkie, 🐺 Lone Wolf, 💃 Drama Enthusiast
-
-🌍 WORLDVIEW & LIFESTYLE
-✈️ Wanderlust Dreamer, 🧠 Deep Diver, 🏞️ Nature Chiller, 🎮 Digital Escapist
-
-Optional (only if clearly supported by music):
-🐉 Fantasy Head, 🪩 Retro Rider, 🧃 Chillwave Surfer
+{TRAIT_MENU}
 """
 
     # Final full prompt
@@ -112,11 +395,61 @@ The user listens to the following songs:
 """
     return prompt.strip(), song_list
 
-def get_personality_traits(prompt):
-    model = ChatGoogleGenerativeAI(model="gemini-2.0-flash", google_api_key=GEMINI_API_KEY, temperature=0.6)
-    return model.invoke(prompt)
+def analysis_fingerprint(df, model=TRAIT_MODEL, temperature=TRAIT_TEMPERATURE, genre_seeded=False):
+    # Sorted by track id so the fingerprint doesn't depend on fetch or grouping order
+    df = df.sort_values("track_id", kind="stable")
+    variant = "genres" if genre_seeded else "tracks"
+    digest = hashlib.sha256(f"{model}|{temperature}|{PROMPT_TEMPLATE_VERSION}|{variant}".encode())
+    for track_id, weight, source in zip(df["track_id"], df["weight"], df["source"]):
+        digest.update(f"\n{track_id}|{weight:.4f}|{source}".encode())
+    return digest.hexdigest()
+
+
+def get_analysis_cache():
+    return get_registry().get("analysis_cache", lambda: AnalysisCache(os.path.join(CACHE_DIR, "analyses.sqlite3")))
+
+
+def get_personality_traits(prompt, fingerprint=None, cache=None, fallback=None):
+    """Gemini's trait breakdown under the "traits" deadline; `fallback()` answers if it's missed."""
+    from langchain_core.messages import AIMessage
+
+    with span("gemini.traits", prompt_tokens=estimate_tokens(prompt)) as traits_span:
+        if fingerprint is not None:
+            cache = cache or get_analysis_cache()
+            cached = cache.get(fingerprint)
+            traits_span.set(cache_hit=cached is not None)
+            if cached is not None:
+                return AIMessage(content=cached)
+        response, path = hedged_call("traits", lambda: get_chat_model().invoke(prompt), fallback)
+        traits_span.set(response_tokens=estimate_tokens(response.content))
+        # A fallback answer is only good for this visit; the next one should get Gemini's
+        if fingerprint is not None and path != "fallback":
+            cache.put(fingerprint, response.content)
+        return response
+
+
+# The fallback prompt keeps only the heaviest tracks
+FALLBACK_TOP_K = 40
+
+
+def traits_fallback(df, local_traits=None, genre_summary=None):
+    """Cheaper stand-in for the full analysis: the genre read if there is one, else a smaller prompt
+    on FALLBACK_MODEL. Its AIMessage says which in response_metadata["trait_source"]."""
+    from langchain_core.messages import AIMessage
+
+    def fallback():
+        if local_traits:
+            return AIMessage(content=local_traits, response_metadata={"trait_source": "local"})
+        prompt, _ = build_music_prompt(df, top_k=FALLBACK_TOP_K, genre_summary=genre_summary)
+        response, _ = hedged_call("traits.fallback", lambda: get_chat_model(FALLBACK_MODEL).invoke(prompt))
+        return AIMessage(content=response.content, response_metadata={"trait_source": "fallback"})
+
+    return fallback
+
+def setup_conversational_chain(trait_summary, song_list, memory_state=None):
+    from langchain.chains import ConversationChain
+    from chat_memory import BoundedChatMemory
 
-def setup_conversational_chain(trait_summary, song_list):
     system_prompt = f"""
 You are a funny, personality-aware assistant who understands users through their music taste.
 
@@ -144,12 +477,197 @@ Each song entry includes:
 6. Be multi-faceted and insightful. Avoid any song references in your responses.
 """
 
-    memory = ConversationBufferMemory()
-    memory.chat_memory.add_message(SystemMessage(content=system_prompt))
+    with span("chain.setup", system_prompt_tokens=estimate_tokens(system_prompt)):
+        llm = get_chat_model()
+        memory = BoundedChatMemory(system_prompt=system_prompt, llm=llm)
+        if memory_state:
+            memory.load_state(memory_state)
+
+        chain = ConversationChain(
+            llm=llm,
+            memory=memory,
+            verbose=True
+        )
+    return chain
+
 
-    chain = ConversationChain(
-        llm=ChatGoogleGenerativeAI(model="gemini-2.0-flash", google_api_key=GEMINI_API_KEY, temperature=0.6),
-        memory=memory,
-        verbose=True
+# Analyses running in the background between the Connect and Reveal screens, across all sessions
+ANALYSIS_WORKERS = 8
+
+# The results page suggests these; most users ask them first, so they're answered ahead of time
+SAMPLE_QUESTIONS = (
+    "What Harry Potter house would I be in?",
+    "What car model would I be?",
+    "A life goal of mine...",
+)
+# Sample answers in flight at once across all sessions
+SAMPLE_ANSWER_WORKERS = 6
+
+
+def genre_preview(df, sp=None):
+    """Genre aggregates and the instant local trait read; both None without Spotify genres."""
+    from genres import genre_summary, genre_weights, local_trait_summary, resolve_artist_genres
+
+    preview = {"genre_summary": None, "local_traits": None}
+    if sp is None or "artist_ids" not in df:
+        return preview
+    if isinstance(sp, ScheduledSpotify):
+        # Genre lookups run behind the screen; a user waiting on Connect goes first
+        sp = sp.with_priority(BACKGROUND)
+    with span("genres") as genres_span:
+        artist_ids = [artist_id for ids in df["artist_ids"] for artist_id in ids]
+        try:
+            weights = genre_weights(df, resolve_artist_genres(sp, artist_ids))
+        except Exception as e:
+            # Genres only enrich the analysis; never let them block it
+            genres_span.set(skipped=type(e).__name__)
+            return preview
+        genres_span.set(genres=len(weights))
+        if len(weights):
+            preview["genre_summary"] = genre_summary(weights)
+            preview["local_traits"] = local_trait_summary(weights)
+    return preview
+
+
+def profile_drift(df, user_id):
+    from profiles import drift_decision, profile_vector
+
+    with span("profile.drift") as drift_span:
+        vector = profile_vector(df)
+        drift = drift_decision(user_id, vector)
+        drift_span.set(decision=drift["decision"], drift=drift["drift"], threshold=drift["threshold"])
+    METRICS.inc("mirror_profile_decisions_total", decision=drift["decision"])
+    return vector, drift
+
+
+def analyze_library(df, preview=None, user_id=None):
+    with span("analysis", tracks=len(df)) as analysis_span:
+        preview = preview.result() if preview is not None else genre_preview(df)
+        genre_summary = preview["genre_summary"]
+        prompt, song_list = build_music_prompt(df, genre_summary=genre_summary)
+        vector, drift = profile_drift(df, user_id) if user_id else (None, None)
+        if drift and drift["decision"] == "reuse":
+            # Barely moved since the last analysis: keep its traits and skip the LLM
+            trait_summary, trait_source = drift["trait_summary"], "gemini"
+        else:
+            with span("fingerprint"):
+                fingerprint = analysis_fingerprint(df, genre_seeded=bool(genre_summary))
+            # Gemini slow or down: the genre-based read, or a lighter model, beats an error page
+            fallback = traits_fallback(df, preview["local_traits"], genre_summary)
+            response = get_personality_traits(prompt, fingerprint=fingerprint, fallback=fallback)
+            trait_summary = response.content
+            trait_source = response.response_metadata.get("trait_source", "gemini")
+            if vector is not None and trait_source == "gemini":
+                from profiles import get_profile_store
+
+                # Only fresh analyses move the reference profile, so small drifts can't add up unnoticed
+                get_profile_store().put(user_id, vector, trait_summary)
+        analysis_span.set(trait_source=trait_source)
+        chat_chain = setup_conversational_chain(trait_summary, song_list)
+        return {
+            "song_list": song_list,
+            "trait_summary": trait_summary,
+            "trait_source": trait_source,
+            "drift": drift and {key: drift[key] for key in ("decision", "drift", "threshold")},
+            "chat_chain": chat_chain,
+            "sample_answers": precompute_sample_answers(chat_chain),
+        }
+
+
+def normalize_question(text):
+    words = re.sub(r"[^\w\s]", " ", text.casefold()).split()
+    # The page shows the last sample as "Dating Promt: ..."; people copy it, fix it, or drop the prefix
+    if words[:2] in (["dating", "prompt"], ["dating", "promt"]):
+        words = words[2:]
+    return " ".join(words)
+
+
+def _sample_answer(chain, history, question):
+    with span("chat.sample", question=question) as sample_span:
+        prompt = chain.prompt.format_prompt(**{chain.memory.memory_key: history, chain.input_key: question})
+        # Past the deadline the question is simply answered live if asked
+        answer = hedged_call("chat.sample", lambda: chain.llm.invoke(prompt))[0].content
+        sample_span.set(prompt_tokens=estimate_tokens(prompt.to_string()), response_tokens=estimate_tokens(answer))
+        return answer
+
+
+def precompute_sample_answers(chain, questions=SAMPLE_QUESTIONS):
+    """Start answering the sample questions against the chain's fresh context; normalized question -> future."""
+    executor = get_registry().get(
+        "sample_answer_executor",
+        lambda: ThreadPoolExecutor(max_workers=SAMPLE_ANSWER_WORKERS, thread_name_prefix="samples"),
     )
-    return chain
+    history = chain.memory.load_memory_variables({})[chain.memory.memory_key]
+    return {normalize_question(question): submit(executor, _sample_answer, chain, history, question) for question in questions}
+
+
+def sample_reply(chain, sample_answers, user_input):
+    """The precomputed answer to this question, recorded in the chat memory; None to ask the LLM live."""
+    answer = (sample_answers or {}).pop(normalize_question(user_input), None)
+    if answer is None:
+        return None
+    with span("chat.turn", sample=True) as turn_span:
+        try:
+            # Still in flight, it's usually ahead of a fresh call; but never waited on longer than a
+            # live reply may take to start
+            response = answer.result(timeout=LLM_DEADLINES["chat"])
+        except TimeoutError:
+            turn_span.set(sample_timeout=True)
+            return None
+        except Exception:
+            turn_span.set(sample_failed=True)
+            return None
+        chain.memory.save_context({chain.input_key: user_input}, {chain.output_key: response})
+        turn_span.set(response_tokens=estimate_tokens(response))
+    return response
+
+
+def submit_analysis(df, sp=None):
+    executor = get_registry().get(
+        "analysis_executor",
+        lambda: ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix="analysis"),
+    )
+    # The preview is queued first, so the analysis waiting on it can never starve it of a worker
+    user_id = spotify_user_id(sp) if sp is not None else None
+    preview = submit(executor, genre_preview, df, sp)
+    return {"preview": preview, "analysis": submit(executor, analyze_library, df, preview, user_id)}
+
+
+def stream_chat_reply(chain, user_input, timings=None):
+    """Yield the chain's reply chunk by chunk; memory is updated once the stream completes."""
+    from langchain_core.messages import AIMessageChunk
+
+    with span("chat.turn") as turn_span:
+        inputs = chain.prep_inputs({chain.input_key: user_input})
+        prompt = chain.prompt.format_prompt(**{key: inputs[key] for key in chain.prompt.input_variables})
+        started = time.perf_counter()
+        first_token = None
+        parts = []
+        chunks, path = hedged_stream(
+            "chat",
+            lambda: chain.llm.stream(prompt),
+            lambda: get_chat_model(FALLBACK_MODEL).stream(prompt),
+            unavailable=AIMessageChunk(content=CHAT_UNAVAILABLE_REPLY),
+        )
+        for chunk in chunks:
+            if first_token is None:
+                first_token = time.perf_counter() - started
+            parts.append(chunk.content)
+            yield chunk.content
+        response = "".join(parts)
+        turn_span.set(
+            time_to_first_token=first_token,
+            prompt_tokens=estimate_tokens(prompt.to_string()),
+            response_tokens=estimate_tokens(response),
+        )
+        # An apology isn't part of the conversation; the question can simply be asked again
+        if path != "unavailable":
+            chain.memory.save_context({chain.input_key: user_input}, {chain.output_key: response})
+        if timings is not None:
+            timings.append({
+                "time_to_first_token": first_token,
+                "total_time": time.perf_counter() - started,
+                "prompt_tokens": estimate_tokens(prompt.to_string()),
+                "response_chars": len(response),
+                "llm_path": path,
+            })
@@ -0,0 +1,91 @@
+# profiles.py
+#
+# Per-user listening profile from the last Gemini analysis. On reconnect the new profile is
+# compared with it, and the old trait breakdown is reused while the drift stays under a threshold;
+# recently played alone changes a few rows every visit, which the exact-match cache can't absorb.
+
+import json
+import os
+import threading
+import time
+import zlib
+
+from clients import get_registry, open_sqlite
+from logic import CACHE_DIR, PROMPT_TEMPLATE_VERSION, TRAIT_MODEL, TRAIT_TEMPERATURE
+
+# 1 - weighted Jaccard similarity at or below which the previous analysis is reused
+PROFILE_DRIFT_THRESHOLD = float(os.environ.get("MIRROR_DRIFT_THRESHOLD", "0.15"))
+
+# Traits from another model or prompt version are never reused, however close the profile is
+PROFILE_VARIANT = f"{TRAIT_MODEL}|{TRAIT_TEMPERATURE}|{PROMPT_TEMPLATE_VERSION}"
+
+
+def profile_vector(df):
+    """Track and artist weights in one sparse vector; both halves sum to the library's total weight."""
+    tracks = df.groupby("track_id", sort=False)["weight"].sum()
+    artists = df.groupby("artists", sort=False)["weight"].sum()
+    vector = {f"t:{track_id}": float(weight) for track_id, weight in tracks.items()}
+    vector.update((f"a:{artist}", float(weight)) for artist, weight in artists.items())
+    return vector
+
+
+def weighted_jaccard(a, b):
+    keys = a.keys() | b.keys()
+    high = sum(max(a.get(key, 0.0), b.get(key, 0.0)) for key in keys)
+    if not high:
+        return 1.0
+    return sum(min(a.get(key, 0.0), b.get(key, 0.0)) for key in keys) / high
+
+
+class ProfileStore:
+    """user id -> profile vector and the trait breakdown Gemini gave for it, in SQLite."""
+
+    def __init__(self, path=os.path.join(CACHE_DIR, "profiles.sqlite3")):
+        self._lock = threading.Lock()
+        self._db = open_sqlite(
+            path,
+            """CREATE TABLE IF NOT EXISTS profiles (
+                user_id TEXT PRIMARY KEY, variant TEXT NOT NULL, vector BLOB NOT NULL,
+                trait_summary TEXT NOT NULL, analyzed_at REAL NOT NULL)""",
+        )
+
+    def get(self, user_id, variant=PROFILE_VARIANT):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT vector, trait_summary, analyzed_at FROM profiles WHERE user_id = ? AND variant = ?",
+                (user_id, variant),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"vector": json.loads(zlib.decompress(row[0])), "trait_summary": row[1], "analyzed_at": row[2]}
+
+    def put(self, user_id, vector, trait_summary, variant=PROFILE_VARIANT):
+        blob = zlib.compress(json.dumps(vector, separators=(",", ":")).encode("utf-8"))
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO profiles VALUES (?, ?, ?, ?, ?)",
+                (user_id, variant, blob, trait_summary, time.time()),
+            )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def get_profile_store():
+    return get_registry().get("profile_store", ProfileStore)
+
+
+def drift_decision(user_id, vector, store=None, threshold=PROFILE_DRIFT_THRESHOLD):
+    """Compare with the user's last analyzed profile: "reuse", "reanalyze", or "new" without one."""
+    store = store or get_profile_store()
+    previous = store.get(user_id)
+    if previous is None:
+        return {"decision": "new", "drift": None, "threshold": threshold, "trait_summary": None}
+    drift = 1 - weighted_jaccard(previous["vector"], vector)
+    return {
+        "decision": "reuse" if drift <= threshold else "reanalyze",
+        "drift": drift,
+        "threshold": threshold,
+        "trait_summary": previous["trait_summary"],
+    }
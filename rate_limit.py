@@ -0,0 +1,173 @@
+# rate_limit.py
+#
+# One scheduler per server process in front of every Spotify call: a token bucket shared by all
+# sessions, a global pause when Spotify answers 429 with Retry-After, interactive requests served
+# before background ones, and identical in-flight requests of the same user sharing one response.
+
+import hashlib
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+
+from clients import get_registry
+from tracing import METRICS
+
+# Spotify's quota is a rolling 30 s window per app; stay well under it and allow short bursts
+SPOTIFY_RATE = 20.0
+SPOTIFY_BURST = 40
+
+# Lower runs first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+MAX_RATE_LIMIT_RETRIES = 3
+# Used when a 429 comes without a usable Retry-After header
+DEFAULT_RETRY_AFTER = 1.0
+
+
+class RateLimiter:
+    """Token bucket whose waiters are served by priority, then arrival order."""
+
+    def __init__(self, rate=SPOTIFY_RATE, burst=SPOTIFY_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters = []
+        self._arrivals = itertools.count()
+        self._cond = threading.Condition()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def acquire(self, priority=INTERACTIVE):
+        """Block until this caller may send one request; returns the seconds spent waiting."""
+        started = time.monotonic()
+        ticket = (priority, next(self._arrivals))
+        with self._cond:
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self._waiters[0] == ticket and now >= self._paused_until and self._tokens >= 1:
+                        self._tokens -= 1
+                        heapq.heappop(self._waiters)
+                        self._cond.notify_all()
+                        return now - started
+                    if self._waiters[0] == ticket:
+                        timeout = max(self._paused_until - now, (1 - self._tokens) / self.rate, 0.001)
+                    else:
+                        timeout = None  # woken when the head of the queue is served
+                    self._cond.wait(timeout)
+            except BaseException:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+                raise
+
+    def pause(self, seconds):
+        # Everyone waits out a Retry-After, not just the session that got the 429
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+            self._cond.notify_all()
+
+
+def retry_after(error):
+    headers = getattr(error, "headers", None) or {}
+    try:
+        return max(float(headers.get("Retry-After")), 0.0)
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+class SpotifyScheduler:
+    """Rate limits, prioritizes and coalesces Spotify calls across every session of the process."""
+
+    def __init__(self, limiter=None):
+        self.limiter = limiter or RateLimiter()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def call(self, key, fn, priority=INTERACTIVE):
+        with self._lock:
+            shared = self._in_flight.get(key)
+            if shared is None:
+                shared = self._in_flight[key] = Future()
+                leader = True
+            else:
+                leader = False
+        if not leader:
+            METRICS.inc("mirror_spotify_requests_total", outcome="coalesced")
+            return shared.result()
+        try:
+            shared.set_result(self._send(fn, priority))
+        except BaseException as e:
+            shared.set_exception(e)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+        return shared.result()
+
+    def _send(self, fn, priority):
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            waited = self.limiter.acquire(priority)
+            METRICS.observe("mirror_spotify_queue_seconds", waited, priority="background" if priority else "interactive")
+            try:
+                result = fn()
+            except Exception as e:
+                if getattr(e, "http_status", None) != 429 or attempt == MAX_RATE_LIMIT_RETRIES:
+                    METRICS.inc("mirror_spotify_requests_total", outcome="error")
+                    raise
+                METRICS.inc("mirror_spotify_requests_total", outcome="rate_limited")
+                self.limiter.pause(retry_after(e))
+                continue
+            METRICS.inc("mirror_spotify_requests_total", outcome="ok")
+            return result
+
+
+def get_spotify_scheduler():
+    return get_registry().get("spotify_scheduler", SpotifyScheduler)
+
+
+def user_key(sp):
+    # Clients built for one session (a double-clicked Connect builds two) share its cached OAuth token
+    auth = getattr(sp, "auth_manager", None)
+    token = auth.get_cached_token() if auth is not None else None
+    if token:
+        return hashlib.sha256(token["access_token"].encode("utf-8")).hexdigest()[:16]
+    return None
+
+
+class ScheduledSpotify:
+    """spotipy.Spotify wrapper whose API calls go through the process-wide SpotifyScheduler."""
+
+    def __init__(self, sp, scheduler=None, priority=INTERACTIVE, key=None):
+        self.sp = sp
+        self.scheduler = scheduler or get_spotify_scheduler()
+        self.priority = priority
+        self._key = key
+
+    def with_priority(self, priority):
+        return ScheduledSpotify(self.sp, self.scheduler, priority, self._key)
+
+    def user_key(self):
+        if self._key is None:
+            self._key = user_key(self.sp)
+        return self._key or f"client:{id(self.sp)}"
+
+    def __getattr__(self, name):
+        attribute = getattr(self.sp, name)
+        if not callable(attribute) or name.startswith("_"):
+            return attribute
+
+        def scheduled(*args, **kwargs):
+            key = (self.user_key(), name, repr(args), repr(sorted(kwargs.items())))
+            return self.scheduler.call(key, lambda: attribute(*args, **kwargs), self.priority)
+
+        return scheduled
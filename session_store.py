@@ -0,0 +1,166 @@
+# session_store.py
+#
+# A session's finished analysis and chat memory, kept outside the Streamlit process so any worker
+# behind a load balancer can pick the session up and a restart doesn't lose it. Only plain data is
+# stored; the LangChain chain is rebuilt from it the next time the session needs one.
+
+import json
+import os
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+
+from clients import get_registry, open_sqlite
+from logic import CACHE_DIR
+
+# Unset or "sqlite": file next to the other caches; "memory": in-process Redis stand-in;
+# "redis://host:6379/0": a real Redis server (needs the optional redis package)
+SESSION_STORE = os.environ.get("MIRROR_SESSION_STORE", "sqlite")
+
+# Sessions nobody came back to for a week are dropped
+SESSION_TTL = 7 * 24 * 3600
+
+# Bump when the stored layout changes; older sessions are then ignored rather than misread
+SESSION_FORMAT = 1
+
+# st.session_state fields saved as-is; the chat memory is saved next to them as "memory"
+SESSION_FIELDS = ("trait_summary", "trait_source", "song_list", "messages")
+
+
+def encode_state(state):
+    payload = json.dumps({"format": SESSION_FORMAT, **state}, ensure_ascii=False, separators=(",", ":"))
+    return zlib.compress(payload.encode("utf-8"))
+
+
+def decode_state(blob):
+    state = json.loads(zlib.decompress(blob).decode("utf-8"))
+    if state.pop("format", None) != SESSION_FORMAT:
+        return None
+    return state
+
+
+class SessionStore(ABC):
+    """Compressed session states keyed by session id; subclasses provide the byte storage."""
+
+    @abstractmethod
+    def get_raw(self, session_id):
+        ...
+
+    @abstractmethod
+    def set_raw(self, session_id, blob):
+        ...
+
+    @abstractmethod
+    def delete(self, session_id):
+        ...
+
+    def load(self, session_id):
+        blob = self.get_raw(session_id)
+        return None if blob is None else decode_state(blob)
+
+    def save(self, session_id, state):
+        blob = encode_state(state)
+        self.set_raw(session_id, blob)
+        return len(blob)
+
+    def footprint(self, session_id):
+        """Bytes this session takes in the store, and before compression."""
+        blob = self.get_raw(session_id)
+        if blob is None:
+            return {"stored_bytes": 0, "raw_bytes": 0}
+        return {"stored_bytes": len(blob), "raw_bytes": len(zlib.decompress(blob))}
+
+
+class SQLiteSessionStore(SessionStore):
+    """Default store: one SQLite file, shared by every Streamlit process on the host."""
+
+    def __init__(self, path=os.path.join(CACHE_DIR, "sessions.sqlite3"), ttl=SESSION_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = open_sqlite(
+            path,
+            "CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, state BLOB NOT NULL, updated_at REAL NOT NULL)",
+            wal=True,
+        )
+
+    def get_raw(self, session_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT state FROM sessions WHERE session_id = ? AND updated_at > ?",
+                (session_id, time.time() - self.ttl),
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def set_raw(self, session_id, blob):
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)", (session_id, blob, now))
+            self._db.execute("DELETE FROM sessions WHERE updated_at <= ?", (now - self.ttl,))
+
+    def delete(self, session_id):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class RedisSessionStore(SessionStore):
+    """Store on anything speaking redis-py's get/set/delete: a Redis server or LocalRedis."""
+
+    def __init__(self, client, prefix="mirror:session:", ttl=SESSION_TTL):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def get_raw(self, session_id):
+        return self.client.get(self.prefix + session_id)
+
+    def set_raw(self, session_id, blob):
+        self.client.set(self.prefix + session_id, blob, ex=self.ttl)
+
+    def delete(self, session_id):
+        self.client.delete(self.prefix + session_id)
+
+
+class LocalRedis:
+    """In-process stand-in for the few redis.Redis commands RedisSessionStore uses."""
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value, expires_at = self._values.get(key, (None, None))
+            if expires_at is not None and expires_at <= time.time():
+                del self._values[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self._values[key] = (value, time.time() + ex if ex else None)
+        return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(self._values.pop(key, None) is not None for key in keys)
+
+
+def build_session_store(target=SESSION_STORE):
+    if target == "sqlite":
+        return SQLiteSessionStore()
+    if target == "memory":
+        return RedisSessionStore(LocalRedis())
+    if target.startswith(("redis://", "rediss://", "unix://")):
+        import redis
+
+        return RedisSessionStore(redis.Redis.from_url(target))
+    raise ValueError(f"Unknown MIRROR_SESSION_STORE: {target}")
+
+
+def get_session_store():
+    return get_registry().get("session_store", build_session_store)
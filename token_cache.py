@@ -0,0 +1,226 @@
+# token_cache.py
+#
+# Spotify OAuth tokens per session, in memory instead of spotipy's shared .cache file, optionally
+# mirrored to an encrypted SQLite file so a restart (or another worker on the host) keeps them.
+# A background thread refreshes the tokens of recently active sessions shortly before they expire,
+# so API calls never stop for an inline refresh.
+#
+# Sessions are keyed by App.py's session id: a hash of a random secret kept in a cookie, never
+# anything that appears in a URL.
+
+import json
+import os
+import threading
+import time
+
+from spotipy.cache_handler import CacheHandler
+
+from clients import get_registry, open_sqlite
+from logic import CACHE_DIR, SPOTIPY_CLIENT_ID, SPOTIPY_CLIENT_SECRET, SPOTIPY_REDIRECT_URI, scope
+from tracing import METRICS, span
+
+# Fernet key (cryptography.fernet.Fernet.generate_key()) enabling the encrypted on-disk copy;
+# without it tokens only live in memory. Needs the optional cryptography package.
+TOKEN_KEY = os.environ.get("MIRROR_TOKEN_KEY")
+
+# Tokens of sessions unused for this long are dropped, from memory and disk; same lifetime as a stored session
+TOKEN_TTL = 7 * 24 * 3600
+
+# Refresh tokens this many seconds before expiry; spotipy itself refreshes inline within 60 s of it
+REFRESH_AHEAD = 300
+REFRESH_CHECK_INTERVAL = 30
+# Only sessions used this recently are kept refreshed; a week of hourly refreshes for everyone
+# who ever connected would be mostly wasted
+REFRESH_ACTIVE_WINDOW = 24 * 3600
+
+TOKEN_SCHEMA = """
+CREATE TABLE IF NOT EXISTS session_tokens (session_key TEXT PRIMARY KEY, token BLOB NOT NULL, used_at REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS session_tokens_used_at ON session_tokens (used_at);
+"""
+# Files at an older PRAGMA user_version are migrated once on open. Version 1: tokens persisted before
+# sessions were keyed by a cookie secret were keyed by a URL parameter, and are dropped.
+TOKEN_SCHEMA_VERSION = 1
+
+
+def _migrate(db):
+    (version,) = db.execute("PRAGMA user_version").fetchone()
+    if version < 1:
+        with db:
+            db.execute("DROP TABLE IF EXISTS tokens")
+    if version < TOKEN_SCHEMA_VERSION:
+        db.execute(f"PRAGMA user_version = {TOKEN_SCHEMA_VERSION}")
+
+
+class TokenStore:
+    """Thread-safe token_info dicts by session key, optionally persisted encrypted, expiring unused."""
+
+    def __init__(self, path=os.path.join(CACHE_DIR, "tokens.sqlite3"), key=TOKEN_KEY, ttl=TOKEN_TTL):
+        self.ttl = ttl
+        # session key -> [token_info, used_at]
+        self._tokens = {}
+        self._lock = threading.Lock()
+        self._fernet = self._db = None
+        if key:
+            from cryptography.fernet import Fernet
+
+            self._fernet = Fernet(key)
+            self._db = open_sqlite(path, TOKEN_SCHEMA)
+            _migrate(self._db)
+
+    def _load(self, session_key):
+        # Caller holds the lock
+        if session_key in self._tokens or self._db is None:
+            return self._tokens.get(session_key)
+        from cryptography.fernet import InvalidToken
+
+        row = self._db.execute(
+            "SELECT token, used_at FROM session_tokens WHERE session_key = ? AND used_at > ?",
+            (session_key, time.time() - self.ttl),
+        ).fetchone()
+        if row is None:
+            return None
+        try:
+            entry = self._tokens[session_key] = [json.loads(self._fernet.decrypt(row[0])), row[1]]
+        except InvalidToken:
+            return None  # written under another key
+        return entry
+
+    def get(self, session_key, touch=True):
+        with self._lock:
+            entry = self._load(session_key)
+            if entry is None:
+                return None
+            if touch:
+                entry[1] = time.time()
+            return entry[0]
+
+    def put(self, session_key, token_info, touch=True):
+        now = time.time()
+        with self._lock:
+            entry = self._load(session_key)
+            used_at = now if touch or entry is None else entry[1]
+            self._tokens[session_key] = [token_info, used_at]
+            if self._db is not None:
+                with self._db:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO session_tokens VALUES (?, ?, ?)",
+                        (session_key, self._fernet.encrypt(json.dumps(token_info).encode("utf-8")), used_at),
+                    )
+                    self._db.execute("DELETE FROM session_tokens WHERE used_at <= ?", (now - self.ttl,))
+
+    def delete(self, session_key):
+        with self._lock:
+            self._tokens.pop(session_key, None)
+            if self._db is not None:
+                with self._db:
+                    self._db.execute("DELETE FROM session_tokens WHERE session_key = ?", (session_key,))
+
+    def active_keys(self, since):
+        """Session keys used at or after `since`, here or (persisted) by another worker."""
+        with self._lock:
+            expired = [key for key, (_, used_at) in self._tokens.items() if used_at <= time.time() - self.ttl]
+            for key in expired:
+                del self._tokens[key]
+            keys = {key for key, (_, used_at) in self._tokens.items() if used_at >= since}
+            if self._db is not None:
+                rows = self._db.execute("SELECT session_key FROM session_tokens WHERE used_at >= ?", (since,))
+                keys.update(row[0] for row in rows)
+        return keys
+
+
+def get_token_store():
+    return get_registry().get("token_store", TokenStore)
+
+
+class SessionTokenHandler(CacheHandler):
+    """spotipy cache handler reading and writing one session's token in the shared TokenStore."""
+
+    def __init__(self, session_key, store=None):
+        self.session_key = session_key
+        self.store = store or get_token_store()
+
+    def get_cached_token(self):
+        return self.store.get(self.session_key)
+
+    def save_token_to_cache(self, token_info):
+        self.store.put(self.session_key, token_info)
+
+
+class _Unsaved(CacheHandler):
+    # The refresher writes refreshed tokens back to the right session key itself
+    def get_cached_token(self):
+        return None
+
+    def save_token_to_cache(self, token_info):
+        pass
+
+
+class TokenRefresher:
+    """One daemon thread sweeping the TokenStore and refreshing tokens about to expire."""
+
+    def __init__(self, store=None, ahead=REFRESH_AHEAD, interval=REFRESH_CHECK_INTERVAL, active_window=REFRESH_ACTIVE_WINDOW):
+        self._store = store
+        self.ahead = ahead
+        self.interval = interval
+        self.active_window = active_window
+        self._oauth = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def store(self):
+        # Looked up on first use: the refresher itself is built inside the registry's lock
+        if self._store is None:
+            self._store = get_token_store()
+        return self._store
+
+    def oauth(self):
+        # One client-credentials holder for every refresh; per-session state lives in the store
+        if self._oauth is None:
+            from spotipy.oauth2 import SpotifyOAuth
+
+            self._oauth = SpotifyOAuth(
+                client_id=SPOTIPY_CLIENT_ID,
+                client_secret=SPOTIPY_CLIENT_SECRET,
+                redirect_uri=SPOTIPY_REDIRECT_URI,
+                scope=scope,
+                cache_handler=_Unsaved(),
+                requests_session=get_registry().spotify_session(),
+            )
+        return self._oauth
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="token-refresher", daemon=True)
+                self._thread.start()
+
+    def refresh_due(self, now=None):
+        now = now or time.time()
+        refreshed = 0
+        for session_key in self.store.active_keys(now - self.active_window):
+            token_info = self.store.get(session_key, touch=False)
+            if not token_info or not token_info.get("refresh_token") or token_info["expires_at"] - now > self.ahead:
+                continue
+            try:
+                with span("spotify.token_refresh"):
+                    token_info = self.oauth().refresh_access_token(token_info["refresh_token"])
+                self.store.put(session_key, token_info, touch=False)
+                refreshed += 1
+                METRICS.inc("mirror_token_refreshes_total", outcome="ok")
+            except Exception:
+                # Left to spotipy's inline refresh on the next call; retried on the next sweep too
+                METRICS.inc("mirror_token_refreshes_total", outcome="error")
+        return refreshed
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.refresh_due()
+
+    def stop(self):
+        self._stopped.set()
+
+
+def get_token_refresher():
+    return get_registry().get("token_refresher", TokenRefresher)
@@ -0,0 +1,208 @@
+# tracing.py
+#
+# Spans around pipeline stages and chat turns. A finished span feeds the process-wide metrics
+# (Prometheus text via prometheus_text()), is logged as one JSON line on the "mirror.trace"
+# logger, and is kept in the active Trace, which App.py holds per session for its debug panel.
+
+import contextvars
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger("mirror.trace")
+
+# MIRROR_TRACE_LOG=- logs spans to stderr, any other value is a file the JSON lines are appended to
+TRACE_LOG = os.environ.get("MIRROR_TRACE_LOG")
+
+# A session keeps its most recent spans only
+TRACE_MAX_SPANS = 500
+
+# Upper bounds (seconds) of the stage duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_active_trace = contextvars.ContextVar("mirror_trace", default=None)
+_current_span = contextvars.ContextVar("mirror_span", default=None)
+_span_ids = itertools.count(1)
+
+
+class Trace:
+    """Finished spans of one session, oldest first."""
+
+    def __init__(self, max_spans=TRACE_MAX_SPANS):
+        self._spans = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock:
+            self._spans.append(record)
+
+    def spans(self):
+        with self._lock:
+            return list(self._spans)
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+
+class Metrics:
+    """Counters and duration histograms derived from finished spans."""
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            # Per-bucket counts plus sum and count; made cumulative when rendered
+            histogram = self._histograms.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0, 0])
+            histogram[next((i for i, bound in enumerate(self.buckets) if seconds <= bound), len(self.buckets))] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    def record_span(self, record):
+        stage, attributes = record["name"], record["attributes"]
+        self.inc("mirror_spans_total", stage=stage, status=record["status"])
+        self.observe("mirror_stage_duration_seconds", record["duration"], stage=stage)
+        for kind in ("prompt", "response"):
+            if f"{kind}_tokens" in attributes:
+                self.inc("mirror_llm_tokens_total", attributes[f"{kind}_tokens"], stage=stage, kind=kind)
+        if "cache_hit" in attributes:
+            self.inc("mirror_cache_lookups_total", stage=stage, result="hit" if attributes["cache_hit"] else "miss")
+        for attribute, result in (("cache_hits", "hit"), ("cache_misses", "miss")):
+            if attributes.get(attribute):
+                self.inc("mirror_cache_lookups_total", attributes[attribute], stage=stage, result=result)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counters), {key: list(value) for key, value in self._histograms.items()}
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+METRICS = Metrics()
+
+
+def _labels(pairs, extra=()):
+    pairs = (*pairs, *extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+def prometheus_text(metrics=METRICS):
+    """All metrics in the Prometheus text exposition format."""
+    counters, histograms = metrics.snapshot()
+    lines, typed = [], set()
+    for (name, labels), value in sorted(counters.items()):
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name}{_labels(labels)} {value}")
+    for (name, labels), histogram in sorted(histograms.items()):
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} histogram")
+        cumulative = 0
+        for bound, count in zip((*metrics.buckets, "+Inf"), histogram):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels(labels, (('le', bound),))} {cumulative}")
+        lines.append(f"{name}_sum{_labels(labels)} {histogram[-2]:.6f}")
+        lines.append(f"{name}_count{_labels(labels)} {histogram[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+class Span:
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.id = next(_span_ids)
+        self.parent = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.parent = _current_span.get()
+        _current_span.set(self)
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._started
+        # Streamlit's st.rerun()/st.stop() and a closed generator unwind through spans as BaseExceptions;
+        # that is control flow, not a failure
+        failed = exc_type is not None and issubclass(exc_type, Exception)
+        # Set, not reset: a chat turn's span lives in a generator that may be closed from another context
+        _current_span.set(self.parent)
+        record = {
+            "name": self.name,
+            "id": self.id,
+            "parent": self.parent.id if self.parent else None,
+            "started_at": self.started_at,
+            "duration": duration,
+            "status": "error" if failed else "ok",
+            "thread": threading.current_thread().name,
+            "attributes": self.attributes,
+        }
+        if failed:
+            record["error"] = exc_type.__name__
+        METRICS.record_span(record)
+        trace = _active_trace.get()
+        if trace is not None:
+            trace.add(record)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(record, default=str, ensure_ascii=False))
+        return False
+
+
+def span(name, **attributes):
+    """Time a block: `with span("dedupe", rows_in=len(df)) as s: ... s.set(rows_out=...)`."""
+    return Span(name, attributes)
+
+
+def annotate(**attributes):
+    # Attach attributes to whichever span encloses the caller, if any
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def activate(trace):
+    """Make `trace` collect the spans of this thread and of work it submits through submit()."""
+    _active_trace.set(trace)
+    _current_span.set(None)
+
+
+def submit(executor, fn, *args, **kwargs):
+    # Each task runs in its own copy of the caller's context, so its spans land in the caller's trace
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def configure_logging(target):
+    handler = logging.StreamHandler(sys.stderr) if target == "-" else logging.FileHandler(target, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+if TRACE_LOG:
+    configure_logging(TRACE_LOG)